@@ -6,6 +6,7 @@ from dotenv import load_dotenv
 from tqdm import tqdm
 from models.model import ModelParameters
 from models.model_manager import ModelManager
+from models.response_cache import cache_sample
 from utils.helpers import load_config
 import logging
 from datetime import datetime
@@ -149,12 +150,15 @@ class LLMEvalStudy:
 
         while retries < max_retries:
             try:
-                if model == "gpt-4o":
-                    response, confidence = self.model_manager.inference_model(model, 'llm-judge-study', prompt_params,
-                                                                              mode=mode)
-                else:
-                    response = self.model_manager.inference_model(model, 'llm-judge-study', prompt_params, mode=mode)
-                    confidence = None
+                # A retry after an invalid response must not replay that response from the cache.
+                with cache_sample(retry=retries):
+                    if model == "gpt-4o":
+                        response, confidence = self.model_manager.inference_model(model, 'llm-judge-study',
+                                                                                  prompt_params, mode=mode)
+                    else:
+                        response = self.model_manager.inference_model(model, 'llm-judge-study', prompt_params,
+                                                                      mode=mode)
+                        confidence = None
 
                 # Attempt YAML parsing
                 parsed_response = yaml.safe_load(response)
@@ -193,7 +197,10 @@ class LLMEvalStudy:
                         mode = "deterministic" if i < 10 else "creative"
 
                         try:
-                            result, real_confidence, prompt_params = self.evaluate_meme(model_name, claim_number, meme_number, mode)
+                            # Repetitions are independent samples of the same prompt, each with its own cache entry.
+                            with cache_sample(repetition=i):
+                                result, real_confidence, prompt_params = self.evaluate_meme(model_name, claim_number,
+                                                                                            meme_number, mode)
 
                             if result:
                                 # Store successful evaluation
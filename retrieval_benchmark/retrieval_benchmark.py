@@ -0,0 +1,146 @@
+import json
+import multiprocessing
+import resource
+import subprocess
+import time
+from concurrent.futures import ProcessPoolExecutor
+from copy import deepcopy
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from rag.vector_db import VectorDB
+from utils.helpers import load_config, get_git_root
+
+
+def _merge(base, override):
+    merged = deepcopy(base)
+    for key, value in override.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = _merge(merged[key], value)
+        else:
+            merged[key] = value
+    return merged
+
+
+def _article_data(row):
+    # The query fields modules.module2_selection.get_article_data builds from a PolitiFactArticle: the claim, the
+    # iytis and the verdict, and the rationale only when there is no iytis. Title is left out because PolitiFact
+    # articles have none. The rows have no url, which a PolitiFactArticle requires, so they are read directly.
+    article_data = {'claim': row['claim']}
+    if pd.notna(row['iytis']):
+        article_data['iytis'] = row['iytis']
+    if pd.notna(row['verdict']):
+        article_data['verdict'] = row['verdict']
+    if pd.isna(row['iytis']) and pd.notna(row['rationale']):
+        article_data['rationale'] = row['rationale']
+    return article_data
+
+
+def run_configuration(retrieval_config, collection, articles, labels, ks):
+    """Benchmarks one retrieval configuration. Runs in a fresh process, so the peak RSS is its own."""
+    nresults = max(ks)
+
+    # The first open builds or syncs the store; the second measures loading an up-to-date one.
+    start = time.perf_counter()
+    VectorDB(collection, retrieval_config)
+    open_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    vector_db = VectorDB(collection, retrieval_config)
+    load_seconds = time.perf_counter() - start
+
+    # Loads the query embedding model outside of the timed queries.
+    vector_db.query_many(articles[:1], nresults)
+
+    latencies = []
+    retrieved = []
+    for article_data in articles:
+        start = time.perf_counter()
+        result = vector_db.query_many([article_data], nresults)[0] or []
+        latencies.append(time.perf_counter() - start)
+        retrieved.append([item['id'] for item in result])
+
+    start = time.perf_counter()
+    vector_db.query_many(articles, nresults)
+    batch_seconds = time.perf_counter() - start
+
+    recall = {}
+    for k in ks:
+        hits = [len(set(retrieved[i][:k]) & expected) / len(expected) for i, expected in labels.items()]
+        recall[f'recall@{k}'] = float(np.mean(hits)) if hits else None
+
+    latencies_ms = np.array(latencies) * 1000
+    return {
+        'open_seconds': open_seconds,
+        'load_seconds': load_seconds,
+        'query_ms_p50': float(np.percentile(latencies_ms, 50)),
+        'query_ms_p95': float(np.percentile(latencies_ms, 95)),
+        'batch_query_seconds': batch_seconds,
+        # ru_maxrss is in kilobytes on Linux.
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        **recall,
+        'retrieved': {str(i): retrieved[i][:nresults] for i in labels},
+    }
+
+
+class RetrievalBenchmark:
+    def __init__(self):
+        self.root_path = get_git_root()
+        self.settings = load_config('retrieval_benchmark.yaml')
+        self.retrieval_config = load_config('retrieval.yaml')
+        # Cached query embeddings would time the cache instead of the retrieval.
+        self.retrieval_config['query_cache'] = {'enabled': False}
+        self.ks = sorted(self.settings['ks'])
+        self.results_path = self.root_path / 'retrieval_benchmark' / 'results'
+
+    def _load_claims(self):
+        claims = pd.read_csv(self.root_path / self.settings['claims'])
+        labels = pd.read_csv(self.root_path / self.settings['labels'])
+        rows = sorted(set(range(min(self.settings['num_claims'], len(claims)))) | set(labels['row']))
+        articles = [_article_data(claims.iloc[row]) for row in rows]
+        positions = {row: i for i, row in enumerate(rows)}
+        expected = {positions[row]: set(str(template_ids).split(';'))
+                    for row, template_ids in zip(labels['row'], labels['template_ids'])}
+        return articles, expected
+
+    @staticmethod
+    def _git_revision():
+        try:
+            sha = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                 check=True).stdout.strip()
+            dirty = bool(subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'],
+                                        capture_output=True, text=True).stdout.strip())
+        except (OSError, subprocess.CalledProcessError):
+            return 'unknown', False
+        return sha, dirty
+
+    def run(self):
+        articles, labels = self._load_claims()
+        sha, dirty = self._git_revision()
+        results = {'git_sha': sha, 'git_dirty': dirty, 'timestamp': datetime.now().isoformat(timespec='seconds'),
+                   'num_queries': len(articles), 'num_labelled': len(labels), 'ks': self.ks, 'configurations': {}}
+
+        spawn = multiprocessing.get_context('spawn')
+        for name, override in self.settings['configurations'].items():
+            retrieval_config = _merge(self.retrieval_config, override)
+            collection = f"{self.settings['collection_prefix']}_{retrieval_config['vector_db']['backend']}"
+            print(f'RUNNING CONFIGURATION {name}')
+            with ProcessPoolExecutor(max_workers=1, mp_context=spawn) as executor:
+                result = executor.submit(run_configuration, retrieval_config, collection, articles, labels,
+                                         self.ks).result()
+            results['configurations'][name] = {'retrieval_config': retrieval_config, **result}
+            summary = {k: v for k, v in result.items() if k != 'retrieved'}
+            print(json.dumps(summary, indent=2))
+
+        self.results_path.mkdir(parents=True, exist_ok=True)
+        timestamp = datetime.now().strftime("%Y_%m_%d_%H_%M_%S")
+        path = self.results_path / f'{timestamp}_{sha}{"_dirty" if dirty else ""}.json'
+        with open(path, 'w', encoding='utf-8') as file:
+            json.dump(results, file, indent=2)
+        print(f'Saved results to {path}')
+        return results
+
+
+if __name__ == "__main__":
+    benchmark = RetrievalBenchmark()
+    benchmark.run()
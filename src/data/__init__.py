@@ -1 +1 @@
-__all__ = ['virality_dataset', 'schemas', 'img_flip_memes', 'csv', 'scrapers']
+__all__ = ['virality_dataset', 'schemas', 'img_flip_memes', 'csv', 'scrapers', 'template_catalog']
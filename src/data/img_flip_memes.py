@@ -3,6 +3,7 @@ import os
 import glob
 from pathlib import Path
 from rag.knowledge_graph import get_git_root
+from data.template_catalog import get_template_catalog
 from utils.img_flip_api import ImgFlipAPI
 from utils.helpers import download_image
 from data.csv import data_to_csv
@@ -33,8 +34,7 @@ class MemesDataManager:
             print(f'Error loading memes: {e}')
 
     def get_meme_by_id(self, meme_id):
-        ret = self.img_flip_api.get_meme_image(meme_image_id=meme_id).get_data()
-        return ret
+        return get_template_catalog().get_meme_image(meme_id)
 
     def fetch_and_store_meme_data(self):
 
@@ -0,0 +1,150 @@
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Optional
+import pandas as pd
+from data.schemas import MemeImage
+from utils.helpers import get_git_root, load_config
+from utils.img_flip_api import ImgFlipAPI
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class TemplateCatalog:
+    """Local catalog of ImgFlip templates keyed by template_id, serving MemeImage objects without network calls.
+
+    Entries come from a JSON snapshot of ImgFlip's own template data (the image url, size and caption count
+    ImgFlip reports), refreshed when older than the TTL: in bulk with get_memes, and one template at a time
+    with get_meme for templates outside ImgFlip's top 100. The processed IMKG csv lists the known templates
+    and is the fallback when ImgFlip cannot be reached. After a failed refresh ImgFlip is left alone for the
+    retry backoff, so an outage costs one round of requests and not one per lookup.
+    """
+
+    def __init__(self, csv_path: Path, snapshot_path: Path, ttl_days: float = 30, retry_backoff_minutes: float = 15,
+                 img_flip_api=None):
+        self.snapshot_path = Path(snapshot_path)
+        self.ttl_seconds = ttl_days * 24 * 60 * 60
+        self.retry_backoff_seconds = retry_backoff_minutes * 60
+        # When a refresh last failed: None for the bulk refresh, else the template_id. Kept in memory only.
+        self.failed_at = {}
+        self.img_flip_api = img_flip_api or ImgFlipAPI()
+        self.lock = threading.RLock()
+        self.templates = self._load_csv(csv_path)
+        self.snapshot = self._load_snapshot()
+
+    @classmethod
+    def from_config(cls):
+        config = load_config('runtime.yaml').get('template_catalog', {})
+        return cls(csv_path=get_git_root() / 'data' / 'imkg' / 'processed' / 'imkg_final_final_final_processor.csv',
+                   snapshot_path=get_git_root() / config.get('snapshot_path', 'data/cache/imgflip_templates.json'),
+                   ttl_days=config.get('ttl_days', 30),
+                   retry_backoff_minutes=config.get('retry_backoff_minutes', 15))
+
+    @staticmethod
+    def _load_csv(csv_path: Path) -> dict:
+        if not Path(csv_path).exists():
+            return {}
+        df = pd.read_csv(csv_path, usecols=['template_id', 'template_url', 'template_title', 'box_count'])
+        df = df.drop_duplicates(subset='template_id', keep='first')
+        return {str(row['template_id']): row for row in df.to_dict('records')}
+
+    def _load_snapshot(self) -> dict:
+        if not self.snapshot_path.exists():
+            return {'refreshed_at': 0, 'memes': {}}
+        with open(self.snapshot_path, encoding='utf-8') as file:
+            return json.load(file)
+
+    def _save_snapshot(self):
+        self.snapshot_path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.snapshot_path.parent, suffix='.json')
+        with os.fdopen(fd, 'w', encoding='utf-8') as file:
+            json.dump(self.snapshot, file)
+        os.replace(tmp_path, self.snapshot_path)
+
+    def _is_fresh(self, fetched_at: float) -> bool:
+        return time.time() - fetched_at < self.ttl_seconds
+
+    def _is_backing_off(self, key: Optional[str]) -> bool:
+        return key in self.failed_at and time.time() - self.failed_at[key] < self.retry_backoff_seconds
+
+    def _store(self, meme_image: MemeImage, fetched_at: float):
+        entry = meme_image.model_dump(mode='json')
+        entry['fetched_at'] = fetched_at
+        self.snapshot['memes'][str(meme_image.get_id())] = entry
+
+    def refresh(self):
+        """Refreshes the snapshot with ImgFlip's current top templates in a single request."""
+        with self.lock:
+            response = self.img_flip_api.get_top100_used_meme_images()
+            if not response.get_is_success():
+                logger.warning(f"Could not refresh the template catalog: {response.get_message()}")
+                self.failed_at[None] = time.time()
+                return False
+            self.failed_at.pop(None, None)
+            now = time.time()
+            for meme_image in response.get_data():
+                self._store(meme_image, now)
+            self.snapshot['refreshed_at'] = now
+            self._save_snapshot()
+            logger.info(f"Refreshed the template catalog with {len(response.get_data())} templates.")
+            return True
+
+    def _refresh_one(self, template_id: str) -> bool:
+        response = self.img_flip_api.get_meme_image(int(template_id))
+        if not response.get_is_success() or not response.get_data():
+            logger.warning(f"Could not fetch template {template_id} from ImgFlip: {response.get_message()}")
+            self.failed_at[template_id] = time.time()
+            return False
+        self._store(response.get_data(), time.time())
+        self._save_snapshot()
+        return True
+
+    def _from_csv(self, template_id: str) -> Optional[MemeImage]:
+        row = self.templates.get(template_id)
+        if not row:
+            return None
+        # The csv has no size or usage data; nothing downstream relies on them. A missing box count is taken
+        # as ImgFlip's usual two captions.
+        box_count = int(row['box_count']) if pd.notna(row['box_count']) else 2
+        return MemeImage(id=int(template_id), name=row['template_title'], url=row['template_url'],
+                         width=0, height=0, box_count=box_count, times_used=0)
+
+    def get_meme_image(self, template_id) -> Optional[MemeImage]:
+        template_id = str(template_id)
+        entry = self.snapshot['memes'].get(template_id)
+        if entry and self._is_fresh(entry['fetched_at']):
+            return MemeImage(**{k: v for k, v in entry.items() if k != 'fetched_at'})
+
+        with self.lock:
+            # Another thread may have refreshed the entry while this one was waiting.
+            entry = self.snapshot['memes'].get(template_id)
+            if not (entry and self._is_fresh(entry['fetched_at'])):
+                if not self._is_fresh(self.snapshot['refreshed_at']) and not self._is_backing_off(None):
+                    self.refresh()
+                entry = self.snapshot['memes'].get(template_id)
+                # A recently failed bulk refresh means ImgFlip is down, so the single template is not tried either.
+                if (not (entry and self._is_fresh(entry['fetched_at'])) and not self._is_backing_off(None)
+                        and not self._is_backing_off(template_id) and self._refresh_one(template_id)):
+                    entry = self.snapshot['memes'][template_id]
+
+        if entry:
+            return MemeImage(**{k: v for k, v in entry.items() if k != 'fetched_at'})
+        return self._from_csv(template_id)
+
+
+_template_catalog = None
+_template_catalog_lock = threading.Lock()
+
+
+def get_template_catalog() -> TemplateCatalog:
+    """Returns the process-wide template catalog, created from config/runtime.yaml on first use."""
+    global _template_catalog
+    with _template_catalog_lock:
+        if _template_catalog is None:
+            _template_catalog = TemplateCatalog.from_config()
+        return _template_catalog
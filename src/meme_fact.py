@@ -5,7 +5,9 @@ from abc import ABC, abstractmethod
 from data.schemas import Meme
 from typing import List
 
+from models.metrics import get_metrics_recorder
 from models.model import ModelParameters
+from models.response_cache import cache_sample
 from modules.module1_input import InputModule
 from modules.module3_generation import GenerationModule
 from modules.module4_concatenation import ConcatenationModule
@@ -28,6 +30,7 @@ class MemeFact(ABC):
         self.filtered_memes = None
 
     def run(self, args) -> List[Meme]:
+        get_metrics_recorder().start_run()
         parser = InputParser(args)
         input_data = parser.parse()
 
@@ -74,7 +77,8 @@ class MemeFact(ABC):
         params = {
             **args,
             'model_params': ModelParameters(**self.config['model_params']),
-            'parse': self.config[self.class_name].get('parse', 'False') == 'True'
+            'parse': self.config[self.class_name].get('parse', 'False') == 'True',
+            'max_workers': self.config[self.class_name].get('max_workers', 1)
         }
 
         if 'generators' in self.config[self.class_name]:
@@ -83,6 +87,7 @@ class MemeFact(ABC):
             params['evaluators'] = self.config[self.class_name]['evaluators']
 
         self.filtered_memes = self._run_impl(input_module, **params)
+        get_metrics_recorder().log_summary()
         if 'manual_save' not in args:
             self._output_memes(args['bot'])
         return self.filtered_memes
@@ -92,8 +97,10 @@ class MemeFact(ABC):
 
     def _run_moderation_pipeline(self, generation_module: GenerationModule, num_memes: int,
                                  enable_moderation: bool, model: str, prompt_type: str) -> List[Meme]:
+        max_attempts = self.config.get('moderation', {}).get('max_attempts', 3)
         moderation_pipeline = MemeModerationPipeline(generation_module=generation_module,
-                                                     enable_moderation=enable_moderation)
+                                                     enable_moderation=enable_moderation,
+                                                     max_attempts=max_attempts)
         return moderation_pipeline.run(num_memes=num_memes, model=model, prompt_type=prompt_type)
 
     @abstractmethod
@@ -102,8 +109,11 @@ class MemeFact(ABC):
 
 
 class MemeModerationPipeline:
-    def __init__(self, generation_module: GenerationModule, enable_moderation: bool):
+    def __init__(self, generation_module: GenerationModule, enable_moderation: bool, max_attempts: int = 3):
+        if max_attempts < 1:
+            raise ValueError("Invalid input. max_attempts must be greater than 0.")
         self.generation_module = generation_module
+        self.max_attempts = max_attempts
         self.concatenation_module = ConcatenationModule()
         self.moderation_module = ModerationModule(enable_moderation=enable_moderation)
 
@@ -115,12 +125,19 @@ class MemeModerationPipeline:
         return True
 
     def run(self, num_memes: int, model: str, prompt_type: str) -> List[Meme]:
-        while True:
-            non_captioned_memes = self.generation_module.generate_captions(num_memes, model, prompt_type)
+        # Only generation is repeated: the selection module keeps its retrieval result for the whole run.
+        for attempt in range(1, self.max_attempts + 1):
+            # A retry must be able to produce a different batch, so it does not replay cached responses.
+            with cache_sample(attempt=attempt):
+                non_captioned_memes = self.generation_module.generate_captions(num_memes, model, prompt_type)
             meme_candidates = self.concatenation_module.generate_memes(non_captioned_memes)
             filtered_memes = self.moderation_module.moderate_memes(meme_candidates)
             safe_flag = self._verify_memes(filtered_memes)
 
             if safe_flag:
-                break
-        return filtered_memes
+                return filtered_memes
+            logger.info(f"Moderation attempt {attempt} of {self.max_attempts} produced hateful memes.")
+
+        logger.warning(f"Every meme batch had hateful memes after {self.max_attempts} attempts. "
+                       f"Keeping only the memes of the last batch that were not considered hateful.")
+        return [meme for meme in filtered_memes if not meme.is_hateful()]
@@ -1 +1 @@
-__all__ = ['open_source', 'proprietary', 'model', 'model_manager', 'prompt', 'hmd']
+__all__ = ['open_source', 'proprietary', 'model', 'model_manager', 'prompt', 'hmd', 'response_cache', 'metrics', 'rate_limiter']
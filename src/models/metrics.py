@@ -0,0 +1,215 @@
+import contextvars
+import json
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
+import numpy as np
+from utils.helpers import get_git_root, load_config
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# The call being measured and the stage label (debate round, CoV step, ...) of the current thread or task.
+# Thread pools do not inherit context variables, so callers that fan out should submit with copy_context().run.
+_current_call = contextvars.ContextVar('current_call', default=None)
+_current_label = contextvars.ContextVar('current_label', default=None)
+
+
+@dataclass
+class CallRecord:
+    model: str
+    prompt_type: str
+    label: Optional[str] = None
+    started_at: str = field(default_factory=lambda: datetime.now().isoformat())
+    wall_time: Optional[float] = None
+    ttfb: Optional[float] = None
+    input_tokens: Optional[int] = None
+    output_tokens: Optional[int] = None
+    retries: int = 0
+    throttled: float = 0.0
+    cached: bool = False
+    error: Optional[str] = None
+    _start: float = field(default_factory=time.perf_counter, repr=False)
+
+    def to_dict(self):
+        return {k: v for k, v in asdict(self).items() if not k.startswith('_')}
+
+
+@contextmanager
+def call_label(label: str):
+    """Labels every model call made inside the block, e.g. with a debate round or a CoV step."""
+    token = _current_label.set(label)
+    try:
+        yield
+    finally:
+        _current_label.reset(token)
+
+
+def get_current_call() -> Optional[CallRecord]:
+    return _current_call.get()
+
+
+def record_first_byte():
+    """Marks the time the provider started answering, which for non-streamed calls is when the response arrived.
+    Only the first mark of a call is kept."""
+    call = _current_call.get()
+    if call and call.ttfb is None:
+        call.ttfb = time.perf_counter() - call._start
+
+
+def record_usage(input_tokens=None, output_tokens=None):
+    """Adds token usage to the current call; calls that chain several requests report each of them."""
+    call = _current_call.get()
+    if call:
+        if input_tokens is not None:
+            call.input_tokens = (call.input_tokens or 0) + input_tokens
+        if output_tokens is not None:
+            call.output_tokens = (call.output_tokens or 0) + output_tokens
+
+
+def record_retry(count=1):
+    call = _current_call.get()
+    if call:
+        call.retries += count
+
+
+def record_throttle(seconds: float):
+    """Adds time the current call spent waiting on a provider rate limit."""
+    call = _current_call.get()
+    if call:
+        call.throttled += seconds
+
+
+def record_retry_state(retry_state):
+    """tenacity before_sleep hook counting the retries of the current call."""
+    record_retry()
+
+
+def record_error(error):
+    call = _current_call.get()
+    if call:
+        call.error = f"{type(error).__name__}: {error}" if isinstance(error, BaseException) else str(error)
+
+
+def _percentile(values, q):
+    return float(np.percentile(values, q)) if values else None
+
+
+class MetricsRecorder:
+    """Collects one CallRecord per model call and appends it to a JSONL file.
+
+    Only the calls of the current run (see start_run) are kept in memory for its summary, at most max_records
+    of them; the JSONL file is the complete record.
+    """
+
+    def __init__(self, path: Optional[Path], enabled: bool = True, max_records: int = 10000):
+        self.path = Path(path) if path else None
+        self.enabled = enabled
+        self.records = deque(maxlen=max_records)
+        self.run_calls = 0
+        self.lock = threading.Lock()
+
+        if self.enabled and self.path:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+
+    @classmethod
+    def from_config(cls):
+        config = load_config('runtime.yaml').get('metrics', {})
+        path = config.get('path', 'data/metrics/model_calls.jsonl')
+        return cls(path=get_git_root() / path if config.get('export', True) else None,
+                   enabled=config.get('enabled', True),
+                   max_records=config.get('max_records', 10000))
+
+    def start_run(self):
+        """Starts a new run: the summary only covers the calls recorded from here on."""
+        with self.lock:
+            self.records.clear()
+            self.run_calls = 0
+
+    @contextmanager
+    def record_call(self, model: str, prompt_type: str):
+        if not self.enabled:
+            yield None
+            return
+
+        call = CallRecord(model=model, prompt_type=prompt_type, label=_current_label.get())
+        token = _current_call.set(call)
+        try:
+            yield call
+        except BaseException as e:
+            record_error(e)
+            raise
+        finally:
+            _current_call.reset(token)
+            call.wall_time = time.perf_counter() - call._start
+            self._add(call)
+
+    def _add(self, call: CallRecord):
+        with self.lock:
+            self.records.append(call)
+            self.run_calls += 1
+            if self.path:
+                with open(self.path, 'a', encoding='utf-8') as file:
+                    file.write(json.dumps(call.to_dict(), ensure_ascii=False) + '\n')
+
+    def get_records(self):
+        with self.lock:
+            return list(self.records)
+
+    def summary(self):
+        """Aggregates the recorded calls by model, prompt type and label."""
+        groups = {}
+        for call in self.get_records():
+            groups.setdefault((call.model, call.prompt_type, call.label), []).append(call)
+
+        summary = []
+        for (model, prompt_type, label), calls in groups.items():
+            wall_times = [c.wall_time for c in calls if not c.cached]
+            ttfbs = [c.ttfb for c in calls if c.ttfb is not None]
+            summary.append({
+                'model': model,
+                'prompt_type': prompt_type,
+                'label': label,
+                'calls': len(calls),
+                'cached': sum(c.cached for c in calls),
+                'errors': sum(c.error is not None for c in calls),
+                'retries': sum(c.retries for c in calls),
+                'throttled': sum(c.throttled for c in calls),
+                'wall_time_p50': _percentile(wall_times, 50),
+                'wall_time_p95': _percentile(wall_times, 95),
+                'wall_time_total': sum(wall_times),
+                'ttfb_p50': _percentile(ttfbs, 50),
+                'input_tokens': sum(c.input_tokens or 0 for c in calls),
+                'output_tokens': sum(c.output_tokens or 0 for c in calls),
+            })
+        return sorted(summary, key=lambda s: s['wall_time_total'], reverse=True)
+
+    def log_summary(self):
+        if self.run_calls > len(self.records):
+            logger.info(f"Summary of the last {len(self.records)} of {self.run_calls} calls of this run.")
+        for s in self.summary():
+            label = f" [{s['label']}]" if s['label'] else ''
+            p50 = f"{s['wall_time_p50']:.2f}s" if s['wall_time_p50'] is not None else '-'
+            p95 = f"{s['wall_time_p95']:.2f}s" if s['wall_time_p95'] is not None else '-'
+            logger.info(f"{s['model']} {s['prompt_type']}{label}: {s['calls']} calls ({s['cached']} cached, "
+                        f"{s['errors']} errors, {s['retries']} retries, {s['throttled']:.2f}s throttled), p50 {p50}, p95 {p95}, "
+                        f"total {s['wall_time_total']:.2f}s, tokens in/out {s['input_tokens']}/{s['output_tokens']}")
+
+
+_metrics_recorder = None
+_metrics_recorder_lock = threading.Lock()
+
+
+def get_metrics_recorder() -> MetricsRecorder:
+    """Returns the process-wide metrics recorder, created from config/runtime.yaml on first use."""
+    global _metrics_recorder
+    with _metrics_recorder_lock:
+        if _metrics_recorder is None:
+            _metrics_recorder = MetricsRecorder.from_config()
+        return _metrics_recorder
@@ -1,4 +1,5 @@
 import logging
+import threading
 from abc import ABC, abstractmethod
 from dataclasses import dataclass
 from typing import Optional
@@ -9,6 +10,18 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
+_shared_clients = {}
+_shared_clients_lock = threading.RLock()
+
+
+def get_shared_client(name: str, factory):
+    """Returns the process-wide client registered under name, building it with factory on first use."""
+    with _shared_clients_lock:
+        if name not in _shared_clients:
+            _shared_clients[name] = factory()
+        return _shared_clients[name]
+
+
 def parse_content_prefix(content):
     refusal_indicators = [
         "I'm sorry, but I can't",
@@ -44,6 +57,41 @@ def parse_content_prefix(content):
     return contents
 
 
+class StreamingCaptionParser:
+    """Collects a streamed completion line by line until box_count 'Caption N:' lines are complete.
+
+    Once complete, everything after the last caption line is dropped, so get_text() can be handed to
+    parse_content_prefix exactly like a full completion.
+    """
+
+    def __init__(self, box_count: int):
+        self.box_count = box_count
+        self.lines = []
+        self.pending = ''
+        self.captions = 0
+        self.complete = False
+
+    def feed(self, chunk: str) -> bool:
+        """Adds a chunk of streamed text and returns True once all the captions have been received."""
+        if self.complete or not chunk:
+            return self.complete
+        self.pending += chunk
+        *lines, self.pending = self.pending.split('\n')
+        for line in lines:
+            self.lines.append(line)
+            if line.startswith('Caption'):
+                self.captions += 1
+                if self.captions >= self.box_count:
+                    self.complete = True
+                    self.pending = ''
+                    break
+        return self.complete
+
+    def get_text(self) -> str:
+        lines = self.lines if self.complete or not self.pending else self.lines + [self.pending]
+        return '\n'.join(lines).strip()
+
+
 @dataclass
 class ModelParameters:
     temperature: Optional[float] = None
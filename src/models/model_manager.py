@@ -1,22 +1,41 @@
+import threading
 from dotenv import load_dotenv
 from models.open_source.models import PixTralLarge, LlamaVision, QwenVision, QwenPreview
 from models.proprietary.models import Gpt4o, GeminiPro, ClaudeSonnet
 from models.prompt import PromptManager
+from models.response_cache import get_response_cache
 
 
 class ModelManager:
     def __init__(self, params, parse):
         load_dotenv()
-        self.models = {
-            'gpt-4o': Gpt4o(params, parse),
-            'gemini-1.5-pro': GeminiPro(params, parse),
-            'claude-3.5-sonnet': ClaudeSonnet(params, parse),
-            'pixtral-large-2411': PixTralLarge(params),
-            'llama-3.2-90b-vision-instruct': LlamaVision(params),
-            'qwen-2-vl-72b-instruct': QwenVision(params),
-            "qwq-32b-preview": QwenPreview(params)
+        # Wrappers are only built when a model is first used; their provider clients are shared process-wide.
+        self.model_factories = {
+            'gpt-4o': lambda: Gpt4o(params, parse),
+            'gemini-1.5-pro': lambda: GeminiPro(params, parse),
+            'claude-3.5-sonnet': lambda: ClaudeSonnet(params, parse),
+            'pixtral-large-2411': lambda: PixTralLarge(params),
+            'llama-3.2-90b-vision-instruct': lambda: LlamaVision(params),
+            'qwen-2-vl-72b-instruct': lambda: QwenVision(params),
+            "qwq-32b-preview": lambda: QwenPreview(params)
         }
+        self.models = {}
+        self.prompt_managers = {}
+        self.lock = threading.Lock()
+        self.response_cache = get_response_cache()
+
+    def get_model(self, model: str):
+        with self.lock:
+            if model not in self.models:
+                self.models[model] = self.model_factories[model]()
+            return self.models[model]
+
+    def get_prompt_manager(self, model: str) -> PromptManager:
+        model_instance = self.get_model(model)
+        with self.lock:
+            if model not in self.prompt_managers:
+                self.prompt_managers[model] = PromptManager(model_instance, model, self.response_cache)
+            return self.prompt_managers[model]
 
     def inference_model(self, model: str, prompt_type: str, prompt_params, **params):
-        promptManager = PromptManager(self.models[model], model)
-        return promptManager.generate_prompt(prompt_type, prompt_params, **params)
+        return self.get_prompt_manager(model).generate_prompt(prompt_type, prompt_params, **params)
@@ -1,14 +1,17 @@
 import logging
-import requests
 import json
 import os
 from dotenv import load_dotenv
 from typing_extensions import override
 
-from models.model import ModelParameters, BaseModel
+from models.metrics import record_error, record_first_byte, record_retry, record_usage
+from models.model import ModelParameters, BaseModel, get_shared_client
 from models.prompt import Prompt
+from models.rate_limiter import estimate_tokens, get_rate_limiter
 from abc import ABC
 from models.proprietary.models import parse_content_prefix
+from utils.http_transport import get_http_transport
+from utils.image_store import get_image_store
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -17,7 +20,7 @@ logger = logging.getLogger(__name__)
 class OpenSourceModel(BaseModel, ABC):
     def __init__(self, model_name, params: ModelParameters):
         self.model_name = model_name
-        self.api = OpenRouterApi()
+        self.api = get_shared_client('openrouter', OpenRouterApi)
         self.params = params
 
     def prepare_params(self, model_name, **params):
@@ -49,15 +52,18 @@ class OpenRouterApi:
         load_dotenv()
         self.api_key = os.getenv('OPEN_ROUTER_API_KEY')
         self.app_name = os.getenv('OPEN_ROUTER_APP_NAME')
+        self.image_store = get_image_store()
+        self.transport = get_http_transport()
+        self.rate_limiter = get_rate_limiter('openrouter')
 
     def post(self, model, text, image, params):
         content = [{"type": "text", "text": text}]
         if image:
             if isinstance(image, list):
                 for img_url in image:
-                    content.append({"type": "image_url", "image_url": {"url": img_url}})
+                    content.append({"type": "image_url", "image_url": {"url": self.image_store.to_model_url(img_url)}})
             elif isinstance(image, str):
-                content.append({"type": "image_url", "image_url": {"url": image}})
+                content.append({"type": "image_url", "image_url": {"url": self.image_store.to_model_url(image)}})
 
         data = json.dumps({"model": model, "messages": [
             {
@@ -68,7 +74,8 @@ class OpenRouterApi:
                            **params
                            })
         try:
-            response = requests.post(
+            self.rate_limiter.acquire(estimate_tokens(text, image, params.get('max_tokens')))
+            response = self.transport.post(
                 url="https://openrouter.ai/api/v1/chat/completions",
                 headers={
                     "Authorization": f"Bearer {self.api_key}",
@@ -76,10 +83,18 @@ class OpenRouterApi:
                 },
                 data=data
             )
+            record_first_byte()
+            # Retries happen inside the pooled transport, so they are read back from the urllib3 retry history.
+            retries = getattr(response.raw, 'retries', None)
+            if retries:
+                record_retry(len(retries.history))
             response.raise_for_status()
+            usage = response.json().get('usage') or {}
+            record_usage(usage.get('prompt_tokens'), usage.get('completion_tokens'))
             return response
         except Exception as e:
             logger.error(f"Failed to post request to OpenRouter API: {e}")
+            record_error(e)
             return None
 
 
@@ -1,8 +1,12 @@
+import os
 import re
+import threading
+import yaml
 from abc import ABC, abstractmethod
 from dataclasses import dataclass
-from typing import Dict
-from utils.helpers import load_config
+from models.metrics import call_label, get_metrics_recorder
+from models.response_cache import get_cache_sample
+from utils.helpers import get_git_root, load_config
 
 
 def _parse_meme_examples(params):
@@ -25,11 +29,108 @@ class FieldConfig:
     format_template: str
 
 
+FIELD_CONFIG = {
+    'claim': FieldConfig(
+        description="The statement that was fact-checked.",
+        format_template="Claim: {}"
+    ),
+    'verdict': FieldConfig(
+        description="The fact-checker's conclusion about the claim's accuracy.",
+        format_template="Verdict: {}"
+    ),
+    'iytis': FieldConfig(
+        description="A brief summary of the key findings from the complete analysis.",
+        format_template="If-your-time-is-short: {}"
+    ),
+    'rationale': FieldConfig(
+        description="The complete analysis and evidence.",
+        format_template="Full Rationale: {}"
+    ),
+    'title': FieldConfig(
+        description="The fact-checking article's headline.",
+        format_template="Title: {}"
+    ),
+    'kym_about': FieldConfig(
+        description="The meme's about section on the Know Your Meme website.",
+        format_template="Know Your Meme meme's about section: {}"
+    ),
+    'meme_image_description': FieldConfig(
+        description="The visual description of the meme image.",
+        format_template="Meme image description: {}"
+    ),
+    'meme_image_caption_style': FieldConfig(
+        description="A description of the meme image's caption style.",
+        format_template="Meme image caption style: {}"
+    ),
+}
+
+
+class PromptTemplate:
+
+    def __init__(self, text: str):
+        self.text = text
+
+    def render(self, params: dict) -> str:
+        return self.text.format_map(params)
+
+
+class PromptTemplates:
+    """The prompts in config/prompts.yaml, loaded once and compiled per prompt type and step.
+
+    With hot_reload enabled the file's mtime is checked on every lookup and the templates are
+    recompiled when it changes, so prompts can be edited without restarting a long study run.
+    """
+
+    def __init__(self, path, hot_reload: bool = False):
+        self.path = path
+        self.hot_reload = hot_reload
+        self.lock = threading.Lock()
+        self.mtime = None
+        self.templates = {}
+        self._load()
+
+    def _load(self):
+        with open(self.path, 'r') as file:
+            config = yaml.safe_load(file)
+
+        templates = {}
+        for prompt_type, value in config.items():
+            if isinstance(value, dict):
+                for step, text in value.items():
+                    templates[(prompt_type, step)] = PromptTemplate(text)
+            else:
+                templates[(prompt_type, None)] = PromptTemplate(value)
+        self.templates = templates
+        self.mtime = os.path.getmtime(self.path)
+
+    def get(self, prompt_type: str, step=None) -> PromptTemplate:
+        if self.hot_reload:
+            with self.lock:
+                if os.path.getmtime(self.path) != self.mtime:
+                    self._load()
+        return self.templates[(prompt_type, step)]
+
+
+_prompt_templates = None
+_prompt_templates_lock = threading.Lock()
+
+
+def get_prompt_templates() -> PromptTemplates:
+    global _prompt_templates
+    with _prompt_templates_lock:
+        if _prompt_templates is None:
+            hot_reload = load_config('runtime.yaml').get('prompts', {}).get('hot_reload', False)
+            _prompt_templates = PromptTemplates(get_git_root() / 'config' / 'prompts.yaml', hot_reload)
+        return _prompt_templates
+
+
 class PromptManager:
 
-    def __init__(self, model, model_name):
+    def __init__(self, model, model_name, cache=None):
         self.model = model
-        self.prompt_config = load_config('prompts.yaml')
+        self.model_name = model_name
+        self.cache = cache
+        self.prompt_config = get_prompt_templates()
         self.promptTypes = {
             'zero-shot': lambda prompt_params:
             ZeroShotPrompt(self.prompt_config, prompt_params, model_name),
@@ -51,6 +152,34 @@ class PromptManager:
             LlmJudgeStudyPrompt(self.prompt_config, prompt_params, model_name),
         }
 
+    def _prompt(self, prompt, **params):
+        with get_metrics_recorder().record_call(self.model_name, prompt.class_name) as call:
+            return self._cached_prompt(prompt, call, **params)
+
+    def _cached_prompt(self, prompt, call, **params):
+        if not self.cache or not self.cache.is_enabled():
+            return self.model.prompt(prompt, **params)
+
+        key = self.cache.make_key(model_name=self.model_name,
+                                  prompt_type=prompt.class_name,
+                                  text=prompt.get_text(),
+                                  image=prompt.get_image(),
+                                  model_params=self.model.params,
+                                  call_params=params,
+                                  parse=getattr(self.model, 'parse', None),
+                                  sample=get_cache_sample())
+        hit, response = self.cache.get(key)
+        if hit:
+            if call:
+                call.cached = True
+            return response
+
+        response = self.model.prompt(prompt, **params)
+        # Failed calls come back empty and are never cached, so they are retried on the next run.
+        if response:
+            self.cache.put(key, response)
+        return response
+
     def generate_prompt(self, prompt_type, prompt_params, **params):
         def get_mode_for_step(prompt_type, step):
             creative_steps = {
@@ -65,12 +194,12 @@ class PromptManager:
                 step_params = params.copy()
                 step_params['mode'] = get_mode_for_step('cov', step)
 
+                with call_label(step):
+                    ret = self._prompt(self.promptTypes[prompt_type](prompt_params, step, verification_context),
+                                       **step_params)
                 if step == 'final_response':
-                    return self.model.prompt(self.promptTypes[prompt_type](prompt_params, step, verification_context),
-                                             **step_params)
+                    return ret
                 else:
-                    ret = self.model.prompt(self.promptTypes[prompt_type](prompt_params, step, verification_context),
-                                            **step_params)
                     if not ret:
                         return []
                     verification_context[step] = ret
@@ -80,12 +209,12 @@ class PromptManager:
                 step_params = params.copy()
                 step_params['mode'] = get_mode_for_step('cov', step)
 
+                with call_label(step):
+                    ret = self._prompt(self.promptTypes[prompt_type](prompt_params, step, context),
+                                       **step_params)
                 if step == 'self_refinement':
-                    return self.model.prompt(self.promptTypes[prompt_type](prompt_params, step, context),
-                                             **step_params)
+                    return ret
                 else:
-                    ret = self.model.prompt(self.promptTypes[prompt_type](prompt_params, step, context),
-                                            **step_params)
                     if not ret:
                         return []
                     captions = []
@@ -96,65 +225,36 @@ class PromptManager:
                             context.append({'captions': captions, 'reasoning': content.split(': ')[1].strip()})
                             captions = []
         else:
-            return self.model.prompt(self.promptTypes[prompt_type](prompt_params), **params)
+            return self._prompt(self.promptTypes[prompt_type](prompt_params), **params)
 
 
 class Prompt(ABC):
 
-    def __init__(self, config: Dict, params: dict, model: str, step):
+    def __init__(self, config: PromptTemplates, params: dict, model: str, step):
         self.class_name = re.sub(r'(?<!^)(?=[A-Z])', '-',
                                  self.__class__.__name__.split('Prompt')[0]).lower()
-        self.field_config = {
-            'claim': FieldConfig(
-                description="The statement that was fact-checked.",
-                format_template="Claim: {}"
-            ),
-            'verdict': FieldConfig(
-                description="The fact-checker's conclusion about the claim's accuracy.",
-                format_template="Verdict: {}"
-            ),
-            'iytis': FieldConfig(
-                description="A brief summary of the key findings from the complete analysis.",
-                format_template="If-your-time-is-short: {}"
-            ),
-            'rationale': FieldConfig(
-                description="The complete analysis and evidence.",
-                format_template="Full Rationale: {}"
-            ),
-            'title': FieldConfig(
-                description="The fact-checking article's headline.",
-                format_template="Title: {}"
-            ),
-            'kym_about': FieldConfig(
-                description="The meme's about section on the Know Your Meme website.",
-                format_template="Know Your Meme meme's about section: {}"
-            ),
-            'meme_image_description': FieldConfig(
-                description="The visual description of the meme image.",
-                format_template="Meme image description: {}"
-            ),
-            'meme_image_caption_style': FieldConfig(
-                description="A description of the meme image's caption style.",
-                format_template="Meme image caption style: {}"
-            ),
-        }
+        self.field_config = FIELD_CONFIG
+        self.box_count = params.get('box_count') or (params.get('meme_image') or {}).get('box_count')
         self.text, self.image = self._parse_prompt(config, params, model, step)
 
     def get_text(self):
         return self.text
 
+    def get_prompt_type(self):
+        return self.class_name
+
+    def get_box_count(self):
+        return self.box_count
+
     def get_image(self):
         return self.image
 
-    def _load_prompt_template(self, config, params, step):
+    def _load_prompt_template(self, config: PromptTemplates, params, step):
         params['dynamic_section'] = self._build_dynamic_section(params)
-        if step:
-            text = config[self.class_name][step].format(**params)
-        else:
-            text = config[self.class_name].format(**params)
+        text = config.get(self.class_name, step).render(params)
         return text, params
 
-    def _parse_prompt(self, config: Dict, params: dict, model: str, step):
+    def _parse_prompt(self, config: PromptTemplates, params: dict, model: str, step):
         text, params = self._load_prompt_template(config, params, step)
         if not params['meme_image']:
             return text, None
@@ -177,7 +277,7 @@ class Prompt(ABC):
 
 class ZeroShotPrompt(Prompt):
 
-    def __init__(self, config: Dict, params: dict, model: str):
+    def __init__(self, config: PromptTemplates, params: dict, model: str):
         super().__init__(config, params, model, None)
 
     def _build_dynamic_section(self, params):
@@ -192,7 +292,7 @@ class ZeroShotPrompt(Prompt):
 
 class FewShotPrompt(Prompt):
 
-    def __init__(self, config: Dict, params: dict, model: str):
+    def __init__(self, config: PromptTemplates, params: dict, model: str):
         self.meme_examples = _parse_meme_examples(params)
         super().__init__(config, params, model, None)
 
@@ -216,7 +316,7 @@ class FewShotPrompt(Prompt):
 
 class CotPrompt(Prompt):
 
-    def __init__(self, config: Dict, params: dict, model: str):
+    def __init__(self, config: PromptTemplates, params: dict, model: str):
         super().__init__(config, params, model, None)
 
     def _build_dynamic_section(self, params):
@@ -232,7 +332,7 @@ class CotPrompt(Prompt):
 
 class CovPrompt(Prompt):
 
-    def __init__(self, config: Dict, params: dict, model: str, step, verification_context):
+    def __init__(self, config: PromptTemplates, params: dict, model: str, step, verification_context):
         self.verification_context = verification_context
         super().__init__(config, params, model, step)
 
@@ -264,7 +364,7 @@ class CovPrompt(Prompt):
 
 class ClotPrompt(Prompt):
 
-    def __init__(self, config: Dict, params: dict, model: str, step, context):
+    def __init__(self, config: PromptTemplates, params: dict, model: str, step, context):
         self.context = context
         super().__init__(config, params, model, step)
 
@@ -285,7 +385,7 @@ class ClotPrompt(Prompt):
 
 
 class DebateEvaluatePrompt(Prompt):
-    def __init__(self, config: Dict, params: dict, model: str):
+    def __init__(self, config: PromptTemplates, params: dict, model: str):
         self.meme_examples = _parse_meme_examples(params)
         super().__init__(config, params, model, None)
 
@@ -308,7 +408,7 @@ class DebateEvaluatePrompt(Prompt):
 
 
 class DebateImprovedGenerationPrompt(Prompt):
-    def __init__(self, config: Dict, params: dict, model: str):
+    def __init__(self, config: PromptTemplates, params: dict, model: str):
         self.meme_examples = _parse_meme_examples(params)
         super().__init__(config, params, model, None)
 
@@ -331,7 +431,7 @@ class DebateImprovedGenerationPrompt(Prompt):
 
 
 class DebateFinalEvaluatePrompt(Prompt):
-    def __init__(self, config: Dict, params: dict, model: str):
+    def __init__(self, config: PromptTemplates, params: dict, model: str):
         self.meme_examples = _parse_meme_examples(params)
         super().__init__(config, params, model, None)
 
@@ -354,7 +454,7 @@ class DebateFinalEvaluatePrompt(Prompt):
 
 
 class LlmJudgeStudyPrompt(Prompt):
-    def __init__(self, config: Dict, params: dict, model: str):
+    def __init__(self, config: PromptTemplates, params: dict, model: str):
         super().__init__(config, params, model, None)
 
     def _build_dynamic_section(self, params):
@@ -1,21 +1,19 @@
 import os
-import time
-import random
 import google.generativeai as genai
 from abc import ABC
 from typing import override
-from models.model import BaseModel, ModelParameters, parse_content_prefix
+from models.metrics import record_error, record_first_byte, record_retry_state, record_usage
+from models.model import BaseModel, ModelParameters, StreamingCaptionParser, get_shared_client, parse_content_prefix
 from models.prompt import Prompt
-from utils.helpers import encode_image_base64
+from models.rate_limiter import estimate_tokens, get_rate_limiter
+from utils.helpers import load_config
+from utils.image_store import get_image_store
 from openai import OpenAI, OpenAIError
-from tenacity import retry, stop_after_attempt, wait_random_exponential
+from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_random_exponential
 import numpy as np
-import httpx
-import base64
-import mimetypes
 
 
-def _format_token_probabilities(response):
+def _format_token_probabilities(content_logprobs):
     """
     Reassembles the category name from consecutive tokens until encountering a literal ':',
     then checks if that reassembled category is one of:
@@ -26,8 +24,6 @@ def _format_token_probabilities(response):
     Finally, returns an average of all 5 probabilities if found.
     """
 
-    # Retrieve token logprobs
-    content_logprobs = response.choices[0].logprobs.content
     if not content_logprobs:
         print("[DEBUG] No logprobs available in the response.")
         return "No logprobs available in the response."
@@ -136,10 +132,29 @@ def _format_token_probabilities(response):
 
 class ProprietaryModel(BaseModel, ABC):
 
-    def __init__(self, client, params: ModelParameters, parse: bool):
+    def __init__(self, client, params: ModelParameters, parse: bool, provider: str):
         self.client = client
         self.params = params
         self.parse = parse
+        self.image_store = get_image_store()
+        self.streaming = load_config('runtime.yaml').get('streaming', {})
+        self.rate_limiter = get_rate_limiter(provider)
+
+    def _acquire_rate_limit(self, prompt: Prompt):
+        self.rate_limiter.acquire(estimate_tokens(prompt.get_text(), prompt.get_image(), self.params.max_tokens))
+
+    def _get_streaming_parser(self, prompt: Prompt):
+        """Returns a caption parser if the prompt's completion should be streamed and cut short, else None.
+
+        Only parsed prompts of the configured types qualify: their captions are all that is kept from the
+        completion, so whatever the model writes after the last caption can be skipped.
+        """
+        if not (self.parse and self.streaming.get('enabled', False)):
+            return None
+        if prompt.get_prompt_type() not in self.streaming.get('prompt_types', []):
+            return None
+        box_count = prompt.get_box_count()
+        return StreamingCaptionParser(int(box_count)) if box_count else None
 
     def prepare_params(self, model_name, **params):
         final_params = self.params.to_dict(model_name).copy()
@@ -165,50 +180,96 @@ class ProprietaryModel(BaseModel, ABC):
 class Gpt4o(ProprietaryModel):
 
     def __init__(self, params, parse):
-        super().__init__(OpenAI(api_key=os.getenv("OPENAI_API_KEY")), params, parse)
+        super().__init__(get_shared_client('openai', lambda: OpenAI(api_key=os.getenv("OPENAI_API_KEY"))),
+                         params, parse, 'openai')
 
     def _parse_response(self, response):
         return parse_content_prefix(response.choices[0].message.content.strip())
 
     @override
-    @retry(wait=wait_random_exponential(min=1, max=60), stop=stop_after_attempt(3))
     def prompt(self, prompt: Prompt, **params):
+        try:
+            return self._prompt_with_retries(prompt, **params)
+        except Exception as e:
+            print(e)
+            record_error(e)
+            return []
+
+    # OpenAI errors reach tenacity, so they are retried and counted as retries; the final failure is
+    # recorded by prompt.
+    @retry(wait=wait_random_exponential(min=1, max=60), stop=stop_after_attempt(3),
+           retry=retry_if_exception_type(OpenAIError), reraise=True, before_sleep=record_retry_state)
+    def _prompt_with_retries(self, prompt: Prompt, **params):
         image = prompt.get_image()
         content = [{"type": "text", "text": prompt.get_text()}]
-        try:
-            if image:
-                if isinstance(image, list):
-                    for img_url in image:
-                        content.append({
-                            "type": "image_url",
-                            "image_url": {"url": img_url}
-                        })
-                elif isinstance(image, str):
+        if image:
+            if isinstance(image, list):
+                for img_url in image:
                     content.append({
                         "type": "image_url",
-                        "image_url": {"url": image}
+                        "image_url": {"url": self.image_store.to_model_url(img_url)}
                     })
-            params = {
-                "model": "gpt-4o-2024-11-20",
-                "messages": [{"role": "user", "content": content}],
-                **self.prepare_params('gpt-4o', **params)
-            }
-            response = self.client.chat.completions.create(**params)
-            real_confidence = _format_token_probabilities(response)
-
-            return self._parse_response(response) if self.parse else response.choices[0].message.content.strip(), real_confidence
-        except OpenAIError as e:
-            print(e)
-            return []
-        except Exception as e:
-            print(e)
-            return []
+            elif isinstance(image, str):
+                content.append({
+                    "type": "image_url",
+                    "image_url": {"url": self.image_store.to_model_url(image)}
+                })
+        params = {
+            "model": "gpt-4o-2024-11-20",
+            "messages": [{"role": "user", "content": content}],
+            **self.prepare_params('gpt-4o', **params)
+        }
+        self._acquire_rate_limit(prompt)
+        parser = self._get_streaming_parser(prompt)
+        if parser:
+            return self._stream(params, parser)
+
+        response = self.client.chat.completions.create(**params)
+        record_first_byte()
+        if response.usage:
+            record_usage(response.usage.prompt_tokens, response.usage.completion_tokens)
+        real_confidence = _format_token_probabilities(response.choices[0].logprobs.content)
+
+        return self._parse_response(response) if self.parse else response.choices[0].message.content.strip(), real_confidence
+
+    def _stream(self, params, parser: StreamingCaptionParser):
+        stream = self.client.chat.completions.create(stream=True, stream_options={'include_usage': True}, **params)
+        content_logprobs = []
+        usage = None
+        try:
+            for chunk in stream:
+                usage = chunk.usage or usage
+                if not chunk.choices:
+                    continue
+                record_first_byte()
+                choice = chunk.choices[0]
+                if choice.logprobs and choice.logprobs.content:
+                    content_logprobs.extend(choice.logprobs.content)
+                if parser.feed(choice.delta.content or ''):
+                    break
+        finally:
+            # Closing the stream drops the connection, which cancels the rest of the generation.
+            stream.close()
+
+        # Usage only arrives with the last chunk; when the stream is cut short every output token was
+        # seen with its logprob instead.
+        if usage:
+            record_usage(usage.prompt_tokens, usage.completion_tokens)
+        else:
+            record_usage(output_tokens=len(content_logprobs))
+        return parse_content_prefix(parser.get_text()), _format_token_probabilities(content_logprobs)
+
+
+def _configure_genai():
+    genai.configure(api_key=os.getenv('GOOGLE_API_KEY'))
+    return genai
 
 
 class GeminiPro(ProprietaryModel):
     def __init__(self, params, parse):
-        genai.configure(api_key=os.getenv('GOOGLE_API_KEY'))
-        super().__init__(genai, params, parse)
+        super().__init__(get_shared_client('google', _configure_genai), params, parse, 'google')
+        self.model = get_shared_client('gemini-1.5-pro-002',
+                                       lambda: self.client.GenerativeModel(model_name='gemini-1.5-pro-002'))
 
     def _parse_response(self, response):
         return parse_content_prefix(response.text)
@@ -217,52 +278,55 @@ class GeminiPro(ProprietaryModel):
     def prompt(self, prompt: Prompt, **params):
         image = prompt.get_image()
         try:
-            time.sleep(random.uniform(0.5, 1.5))
-            model = self.client.GenerativeModel(model_name='gemini-1.5-pro-002')
+            self._acquire_rate_limit(prompt)
             contents = [prompt.get_text()]
 
             if image:
-                image_parts = []
-                if isinstance(image, list):
-                    for img_url in image:
-                        response = httpx.get(img_url, headers={"User-Agent": "Mozilla/5.0"})
-                        if response.status_code == 200:
-                            # Get the correct MIME type
-                            mime_type = mimetypes.guess_type(img_url)[0]
-                            if mime_type == "image/jpg":  # Convert jpg to jpeg
-                                mime_type = "image/jpeg"
-
-                            image_parts.append({
-                                'mime_type': mime_type,
-                                'data': base64.b64encode(response.content).decode('utf-8')
-                            })
-                elif isinstance(image, str):
-                    response = httpx.get(image)
-                    if response.status_code == 200:
-                        # Get the correct MIME type
-                        mime_type = mimetypes.guess_type(image)[0]
-                        if mime_type == "image/jpg":  # Convert jpg to jpeg
-                            mime_type = "image/jpeg"
-
-                        image_parts = [{
-                            'mime_type': mime_type,
-                            'data': base64.b64encode(response.content).decode('utf-8')
-                        }]
-                # Append the processed images to contents
-                contents += image_parts
-            response = model.generate_content(contents=contents, generation_config={**self.prepare_params('gemini-1.5-pro', **params)})
+                image_urls = image if isinstance(image, list) else [image]
+                for img_url in image_urls:
+                    stored_image = self.image_store.get(img_url)
+                    if stored_image:
+                        contents.append({
+                            'mime_type': stored_image.get_mime_type(),
+                            'data': stored_image.get_base64()
+                        })
+            generation_config = {**self.prepare_params('gemini-1.5-pro', **params)}
+            parser = self._get_streaming_parser(prompt)
+            if parser:
+                return self._stream(contents, generation_config, parser)
+
+            response = self.model.generate_content(contents=contents, generation_config=generation_config)
+            record_first_byte()
+            usage = getattr(response, 'usage_metadata', None)
+            if usage:
+                record_usage(usage.prompt_token_count, usage.candidates_token_count)
 
             return self._parse_response(response) if self.parse else response.text
         except Exception as e:
             print(f"Error in GeminiPro prompt: {e}")
+            record_error(e)
             return []
 
+    def _stream(self, contents, generation_config, parser: StreamingCaptionParser):
+        response = self.model.generate_content(contents=contents, generation_config=generation_config, stream=True)
+        usage = None
+        for chunk in response:
+            record_first_byte()
+            usage = getattr(chunk, 'usage_metadata', None) or usage
+            # Leaving the iterator unconsumed abandons the rest of the stream.
+            if parser.feed(chunk.text if chunk.parts else ''):
+                break
+        if usage:
+            record_usage(usage.prompt_token_count, usage.candidates_token_count)
+        return parse_content_prefix(parser.get_text())
+
 
 class ClaudeSonnet(ProprietaryModel):
 
     def __init__(self, params, parse):
         from anthropic import Anthropic
-        super().__init__(Anthropic(api_key=os.getenv('ANTHROPIC_API_KEY')), params, parse)
+        super().__init__(get_shared_client('anthropic', lambda: Anthropic(api_key=os.getenv('ANTHROPIC_API_KEY'))),
+                         params, parse, 'anthropic')
 
     def _parse_response(self, response):
         return parse_content_prefix(response.content[0].text)
@@ -273,31 +337,48 @@ class ClaudeSonnet(ProprietaryModel):
         try:
             messages = [{"role": "user", "content": [{"type": "text", "text": prompt.get_text()}]}]
             if image:
-                if isinstance(image, list):
-                    for img in image:
-                        messages[0]["content"].append({
-                            "type": "image",
-                            "source": {
-                                "type": "base64",
-                                "media_type": "image/jpeg",
-                                "data": encode_image_base64(img)
-                            }
-                        })
-                elif isinstance(image, str):
+                image_urls = image if isinstance(image, list) else [image]
+                for img_url in image_urls:
+                    stored_image = self.image_store.get(img_url)
+                    if not stored_image:
+                        raise Exception(f"Could not fetch image {img_url}.")
                     messages[0]["content"].append({
                         "type": "image",
                         "source": {
                             "type": "base64",
-                            "media_type": "image/jpeg",
-                            "data": encode_image_base64(image)
+                            "media_type": stored_image.get_mime_type(),
+                            "data": stored_image.get_base64()
                         }
                     })
+            self._acquire_rate_limit(prompt)
+            parser = self._get_streaming_parser(prompt)
+            if parser:
+                return self._stream(messages, params, parser)
+
             response = self.client.messages.create(
                 model="claude-3-5-sonnet-20241022",
                 messages=messages,
                 **self.prepare_params('claude-3.5-sonnet', **params)
             )
+            record_first_byte()
+            record_usage(response.usage.input_tokens, response.usage.output_tokens)
             return self._parse_response(response) if self.parse else response.content[0].text
         except Exception as e:
             print(f"Error in ClaudeSonnet prompt: {e}")
+            record_error(e)
             return []
+
+    def _stream(self, messages, params, parser: StreamingCaptionParser):
+        # Leaving the stream's context closes the connection, which cancels the rest of the generation.
+        with self.client.messages.stream(
+                model="claude-3-5-sonnet-20241022",
+                messages=messages,
+                **self.prepare_params('claude-3.5-sonnet', **params)
+        ) as stream:
+            for text in stream.text_stream:
+                record_first_byte()
+                if parser.feed(text):
+                    break
+            usage = stream.current_message_snapshot.usage
+        record_usage(usage.input_tokens, usage.output_tokens)
+        return parse_content_prefix(parser.get_text())
@@ -0,0 +1,98 @@
+import asyncio
+import logging
+import threading
+import time
+from typing import Optional
+from models.metrics import record_throttle
+from utils.helpers import load_config
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Rough prompt-side cost of one image; providers bill images at a few hundred to ~1k tokens depending on size.
+IMAGE_TOKENS = 800
+
+
+def estimate_tokens(text: str, images=None, max_tokens: Optional[int] = None) -> int:
+    """Estimates the tokens a request counts against a tokens/minute quota: its prompt plus the completion budget."""
+    if isinstance(images, str):
+        images = [images]
+    return len(text or '') // 4 + IMAGE_TOKENS * len(images or []) + (max_tokens or 0)
+
+
+class TokenBucket:
+    """Token bucket refilled continuously at per_minute / 60 units per second, holding at most one minute of budget.
+
+    Callers reserve units up front and the bucket may go into debt; the debt is the time the caller has to
+    wait. Reserving never blocks, so the same bucket works for threads and asyncio tasks and serves them
+    in arrival order.
+    """
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.available = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self, amount: float) -> float:
+        """Takes amount from the bucket and returns the number of seconds to wait before using it."""
+        with self.lock:
+            now = time.monotonic()
+            self.available = min(self.capacity, self.available + (now - self.updated) * self.rate)
+            self.updated = now
+            # A single request larger than the whole budget would otherwise wait forever.
+            self.available -= min(amount, self.capacity)
+            return 0.0 if self.available >= 0 else -self.available / self.rate
+
+
+class RateLimiter:
+    """Requests/minute and tokens/minute budgets of one provider, shared by every model that calls it."""
+
+    def __init__(self, name: str, requests_per_minute: Optional[float] = None,
+                 tokens_per_minute: Optional[float] = None):
+        self.name = name
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+
+    @classmethod
+    def from_config(cls, name: str):
+        config = load_config('runtime.yaml').get('rate_limits', {}).get(name) or {}
+        return cls(name,
+                   requests_per_minute=config.get('requests_per_minute'),
+                   tokens_per_minute=config.get('tokens_per_minute'))
+
+    def _reserve(self, tokens: int) -> float:
+        wait = 0.0
+        if self.requests:
+            wait = max(wait, self.requests.reserve(1))
+        if self.tokens and tokens:
+            wait = max(wait, self.tokens.reserve(tokens))
+        if wait > 0:
+            logger.info(f"Rate limit of {self.name} reached, waiting {wait:.2f}s.")
+            record_throttle(wait)
+        return wait
+
+    def acquire(self, tokens: int = 0):
+        """Blocks the calling thread until a request of the given estimated token count fits the budgets."""
+        wait = self._reserve(tokens)
+        if wait > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self, tokens: int = 0):
+        """Asyncio counterpart of acquire that only suspends the calling task."""
+        wait = self._reserve(tokens)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+
+_rate_limiters = {}
+_rate_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(name: str) -> RateLimiter:
+    """Returns the process-wide limiter of a provider, created from config/runtime.yaml on first use."""
+    with _rate_limiters_lock:
+        if name not in _rate_limiters:
+            _rate_limiters[name] = RateLimiter.from_config(name)
+        return _rate_limiters[name]
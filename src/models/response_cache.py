@@ -0,0 +1,188 @@
+import contextvars
+import hashlib
+import json
+import logging
+import pickle
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import asdict, is_dataclass
+from pathlib import Path
+from utils.helpers import get_git_root, load_config
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+_current_sample = contextvars.ContextVar('response_cache_sample', default={})
+
+
+@contextmanager
+def cache_sample(**indexes):
+    """Marks the calls made inside the block as one sample among deliberate repeats of the same request (e.g.
+    meme=2, attempt=1), so each repeat gets its own cached response instead of replaying the first one."""
+    token = _current_sample.set({**_current_sample.get(), **indexes})
+    try:
+        yield
+    finally:
+        _current_sample.reset(token)
+
+
+def get_cache_sample() -> dict:
+    return _current_sample.get()
+
+
+class CacheMissError(Exception):
+
+    def __init__(self, message):
+        self.message = message
+        super().__init__(self.message)
+
+    def __str__(self):
+        return f"CacheMissError: {self.message}"
+
+
+def _normalize(value):
+    if is_dataclass(value):
+        return asdict(value)
+    if isinstance(value, (list, tuple)):
+        return [_normalize(v) for v in value]
+    if isinstance(value, dict):
+        return {str(k): _normalize(v) for k, v in value.items()}
+    return value
+
+
+class ResponseCache:
+    """On-disk cache of LLM responses keyed by a hash of the normalized request."""
+
+    MODES = ('off', 'read-write', 'replay-only')
+
+    def __init__(self, path: Path, mode: str = 'off', max_size_mb=None, max_age_days=None):
+        if mode not in self.MODES:
+            raise ValueError(f"Response cache mode must be one of {self.MODES}, got '{mode}'.")
+        self.path = Path(path)
+        self.mode = mode
+        self.max_size_bytes = int(max_size_mb * 1024 * 1024) if max_size_mb else None
+        self.max_age_seconds = max_age_days * 24 * 60 * 60 if max_age_days else None
+        self.lock = threading.Lock()
+        self.connection = None
+
+        if self.is_enabled():
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self.connection = sqlite3.connect(str(self.path), check_same_thread=False)
+            self.connection.execute("""
+                CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    value BLOB NOT NULL,
+                    size INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL
+                )""")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at)")
+            self.connection.commit()
+            # Replay-only runs never modify the cache, so recorded responses stay reproducible.
+            if self.mode == 'read-write':
+                self._evict()
+            logger.info(f"Response cache opened in {mode} mode at {self.path}.")
+
+    @classmethod
+    def from_config(cls):
+        config = load_config('runtime.yaml').get('response_cache', {})
+        return cls(path=get_git_root() / config.get('path', 'data/cache/llm_responses.sqlite'),
+                   mode=config.get('mode', 'off'),
+                   max_size_mb=config.get('max_size_mb'),
+                   max_age_days=config.get('max_age_days'))
+
+    def is_enabled(self) -> bool:
+        return self.mode != 'off'
+
+    @staticmethod
+    def make_key(model_name, prompt_type, text, image, model_params, call_params, parse, sample=None) -> str:
+        if isinstance(image, str):
+            image = [image]
+        request = {
+            'model': model_name,
+            'prompt_type': prompt_type,
+            'text': text,
+            'image': image or [],
+            'model_params': _normalize(model_params),
+            'call_params': _normalize(call_params),
+            'parse': parse,
+        }
+        # Only part of the key when set, so requests that are never repeated keep their existing keys.
+        if sample:
+            request['sample'] = _normalize(sample)
+        payload = json.dumps(request, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key: str):
+        """Returns a (hit, response) pair. In replay-only mode a miss raises CacheMissError."""
+        if not self.is_enabled():
+            return False, None
+
+        with self.lock:
+            row = self.connection.execute("SELECT value, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if (row and self.mode == 'read-write' and self.max_age_seconds
+                    and row[1] < time.time() - self.max_age_seconds):
+                self.connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self.connection.commit()
+                row = None
+            if row and self.mode == 'read-write':
+                self.connection.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (time.time(), key))
+                self.connection.commit()
+
+        if row:
+            return True, pickle.loads(row[0])
+        if self.mode == 'replay-only':
+            raise CacheMissError(f"No cached response for request {key} and the cache is in replay-only mode.")
+        return False, None
+
+    def put(self, key: str, response):
+        if self.mode != 'read-write':
+            return
+
+        value = pickle.dumps(response)
+        now = time.time()
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO responses (key, value, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (key, value, len(value), now, now))
+            self.connection.commit()
+            self._evict_locked()
+
+    def _evict(self):
+        with self.lock:
+            self._evict_locked()
+
+    def _evict_locked(self):
+        # Expired entries go first, then the least recently used ones until the cache fits its size budget.
+        if self.max_age_seconds:
+            self.connection.execute("DELETE FROM responses WHERE created_at < ?",
+                                    (time.time() - self.max_age_seconds,))
+        if self.max_size_bytes:
+            total_size = self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+            if total_size > self.max_size_bytes:
+                rows = self.connection.execute("SELECT key, size FROM responses ORDER BY accessed_at").fetchall()
+                evicted = []
+                for key, size in rows:
+                    if total_size <= self.max_size_bytes:
+                        break
+                    evicted.append((key,))
+                    total_size -= size
+                self.connection.executemany("DELETE FROM responses WHERE key = ?", evicted)
+                logger.info(f"Evicted {len(evicted)} entries from the response cache.")
+        self.connection.commit()
+
+
+_response_cache = None
+_response_cache_lock = threading.Lock()
+
+
+def get_response_cache() -> ResponseCache:
+    """Returns the process-wide response cache, opening it from config/runtime.yaml on first use."""
+    global _response_cache
+    with _response_cache_lock:
+        if _response_cache is None:
+            _response_cache = ResponseCache.from_config()
+        return _response_cache
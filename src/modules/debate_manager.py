@@ -1,4 +1,8 @@
+import contextvars
+import time
 import yaml
+from concurrent.futures import ThreadPoolExecutor
+from models.metrics import call_label
 
 
 def _parse_evaluation_feedback(raw_feedback: str) -> dict:
@@ -187,56 +191,73 @@ class DebateManager:
         self.generator2 = generators[1]
         self.evaluator = evaluators[0]
         self.model_manager = model_manager
+        self.round_timings = []
+
+    def get_round_timings(self):
+        """Returns the per-round wall times (in seconds) of every debate run so far."""
+        return self.round_timings
+
+    def _run_generators(self, prompt_type, params1, params2):
+        # Both generators are independent within a round, so they are prompted concurrently. Each one
+        # gets its own params dict because building a prompt writes its dynamic section into it, and its
+        # own copy of the context so the call metrics keep the round label.
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            future1 = executor.submit(contextvars.copy_context().run, self.model_manager.inference_model,
+                                      self.generator1, prompt_type, params1, mode='creative')
+            future2 = executor.submit(contextvars.copy_context().run, self.model_manager.inference_model,
+                                      self.generator2, prompt_type, params2, mode='creative')
+            return future1.result(), future2.result()
 
     def run_debate(self, params):
+        timings = {}
+
         # Round 1: Initial generation
         #print(params)
-        captions1 = self.model_manager.inference_model(self.generator1, 'few-shot', params, mode='creative')
-        captions2 = self.model_manager.inference_model(self.generator2, 'few-shot', params, mode='creative')
+        start = time.perf_counter()
+        with call_label('round1'):
+            captions1, captions2 = self._run_generators('few-shot', params.copy(), params.copy())
+        timings['round1'] = time.perf_counter() - start
         print(f'captions1 round1: {captions1}')
         print(f'captions2 round1: {captions2}')
 
         # Round 2: Evaluation and feedback
+        start = time.perf_counter()
         evaluator_params = params.copy()
         evaluator_params.update({
             'captions1': captions1,
             'captions2': captions2,
         })
-        raw_feedback = self.model_manager.inference_model(
-            self.evaluator,
-            'debate-evaluate',
-            evaluator_params,
-            mode='deterministic')
+        with call_label('round2'):
+            raw_feedback = self.model_manager.inference_model(
+                self.evaluator,
+                'debate-evaluate',
+                evaluator_params,
+                mode='deterministic')
+        timings['round2'] = time.perf_counter() - start
 
         print(f'raw feedback round: {raw_feedback}')
         feedback = _parse_evaluation_feedback(raw_feedback)
         print(f'feedback parsed: {feedback}')
 
         # Round 3: Improved generation with feedback
-        generator_params = params.copy()
-        generator_params.update({
+        generator1_params = params.copy()
+        generator1_params.update({
             'previous_captions': captions1,
             'feedback': _format_feedback_for_generator(feedback['generator1'])
         })
 
-        improved_captions1 = self.model_manager.inference_model(
-            self.generator1,
-            'debate-improved-generation',
-            generator_params,
-            mode='creative')
-        print(f'improved_captions1 round3: {improved_captions1}')
-
-        generator_params = params.copy()
-        generator_params.update({
+        generator2_params = params.copy()
+        generator2_params.update({
             'previous_captions': captions2,
             'feedback': _format_feedback_for_generator(feedback['generator1'])
         })
 
-        improved_captions2 = self.model_manager.inference_model(
-            self.generator2,
-            'debate-improved-generation',
-            generator_params,
-            mode='creative')
+        start = time.perf_counter()
+        with call_label('round3'):
+            improved_captions1, improved_captions2 = self._run_generators('debate-improved-generation',
+                                                                          generator1_params, generator2_params)
+        timings['round3'] = time.perf_counter() - start
+        print(f'improved_captions1 round3: {improved_captions1}')
         print(f'improved_captions2 round3: {improved_captions2}')
 
         # Final evaluation - prepare parameters for final judgment
@@ -247,11 +268,16 @@ class DebateManager:
         })
 
         # Get final evaluation and selection
-        raw_final_result = self.model_manager.inference_model(
-            self.evaluator,
-            'debate-final-evaluate',
-            final_evaluator_params,
-            mode='deterministic')
+        start = time.perf_counter()
+        with call_label('round4'):
+            raw_final_result = self.model_manager.inference_model(
+                self.evaluator,
+                'debate-final-evaluate',
+                final_evaluator_params,
+                mode='deterministic')
+        timings['round4'] = time.perf_counter() - start
+        self.round_timings.append(timings)
+        print(f'debate round timings: {timings}')
         print(f'raw final result round4: {raw_final_result}')
         final_result = _parse_final_evaluation(raw_final_result)
         print(f'final result round4 parsed: {final_result}')
@@ -1,37 +1,49 @@
 import logging
 from modules.module1_input import InputModule
-from rag.vector_db import VectorDB
+from rag.vector_db import VectorDB, get_vector_db
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
+def get_article_data(article):
+    """Returns the article fields used to build a retrieval query; see VectorDB.query and VectorDB.query_many."""
+    article_data = {
+        'claim': article.get_claim(),
+    }
+
+    if article.get_iytis():
+        article_data['iytis'] = article.get_iytis()
+    if article.get_title():
+        article_data['title'] = article.get_title()
+    if article.get_verdict():
+        article_data['verdict'] = article.get_verdict()
+    if not article.get_iytis() and article.get_rationale():
+        article_data['rationale'] = article.get_rationale()
+    return article_data
+
+
 class SelectionModule:
 
-    def __init__(self, input_module: InputModule):
+    def __init__(self, input_module: InputModule, vector_db: VectorDB = None):
         self.input_module = input_module
-        self.vector_db = VectorDB()
+        self.vector_db = vector_db or get_vector_db()
+        # The input is fixed for the module's lifetime, so retrieval results are kept per num_memes and
+        # moderation retries only pay for generation.
+        self.retrieved = {}
         logger.info("SelectionModule initialized")
 
     def rag(self, num_memes: int):
+        if num_memes not in self.retrieved:
+            self.retrieved[num_memes] = self._rag(num_memes)
+        return self.retrieved[num_memes]
+
+    def _rag(self, num_memes: int):
         input_data = self.input_module.get_input()
         article = input_data.get_article()
         meme_image = input_data.get_meme_images()
 
         if not meme_image:
-            article_data = {
-                'claim': article.get_claim(),
-            }
-
-            if article.get_iytis():
-                article_data['iytis'] = article.get_iytis()
-            if article.get_title():
-                article_data['title'] = article.get_title()
-            if article.get_verdict():
-                article_data['verdict'] = article.get_verdict()
-            if not article.get_iytis() and article.get_rationale():
-                article_data['rationale'] = article.get_rationale()
-
-            return self.vector_db.query(None, article_data, num_memes)
+            return self.vector_db.query(None, get_article_data(article), num_memes)
         else:
             return self.vector_db.query(str(meme_image[0].get_id()), None, num_memes)
@@ -1,12 +1,15 @@
+import contextvars
 import logging
-from typing import List
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional, Tuple
 from models.model_manager import ModelManager
 from modules.debate_manager import DebateManager
 from modules.module1_input import AblationInput
-from data.schemas import Meme
+from data.schemas import Meme, MemeImage
 from modules.module2_selection import SelectionModule
 from abc import ABC, abstractmethod
-from utils.img_flip_api import ImgFlipAPI
+from data.template_catalog import get_template_catalog
+from models.response_cache import cache_sample
 
 
 logging.basicConfig(level=logging.INFO)
@@ -15,22 +18,55 @@ logger = logging.getLogger(__name__)
 
 class GenerationModule(ABC):
 
-    def __init__(self, ablation_input: AblationInput, params, parse):
+    def __init__(self, ablation_input: AblationInput, params, parse, max_workers: int = 1):
         self.input = ablation_input
         self.model_manager = ModelManager(params, parse)
-        self.img_flip_api = ImgFlipAPI()
+        self.template_catalog = get_template_catalog()
+        self.max_workers = max(1, int(max_workers))
 
     @abstractmethod
     def generate_captions(self, num_memes: int, model: str, prompt_type: str) -> List[Meme]:
         pass
 
+    def _generate_memes(self, iterations: int, generate_one: Callable[[int], Tuple[MemeImage, Optional[list]]]) -> List[Meme]:
+        """Runs generate_one for every meme index, concurrently when max_workers > 1.
+
+        Results are collected in index order, so the returned memes match the serial path, and an
+        exception raised for one meme is re-raised just like it would be in the serial loop. Every meme index
+        is its own response cache sample, so identical prompts for different memes are not answered alike.
+        """
+        def generate_sample(index):
+            with cache_sample(meme=index):
+                return generate_one(index)
+
+        if self.max_workers > 1 and iterations > 1:
+            # Each task runs in a copy of this context, so the caller's cache sample reaches the worker threads.
+            contexts = [contextvars.copy_context() for _ in range(iterations)]
+            with ThreadPoolExecutor(max_workers=min(self.max_workers, iterations)) as executor:
+                results = list(executor.map(lambda context, index: context.run(generate_sample, index),
+                                            contexts, range(iterations)))
+        else:
+            results = [generate_sample(index) for index in range(iterations)]
+
+        memes = []
+        for current_image, meme_captions in results:
+            if not meme_captions:
+                print(f'Failed attempt to generate captions for {current_image}.')
+                continue
+
+            memes.append(Meme(
+                meme_image=current_image,
+                captions=meme_captions
+            ))
+        return memes
+
     def _prepare_generation_params(self, retrieved_data: list, index: int, params: dict) -> tuple:
         if len(self.input.get_meme_images()) == 1:
             data = retrieved_data[0]
             current_image = self.input.get_meme_images()[0]
         else:
             data = retrieved_data[index]
-            current_image = self.img_flip_api.get_meme_image(data['id']).get_data()
+            current_image = self.template_catalog.get_meme_image(data['id'])
 
         params['meme_image'] = current_image.to_dict()
         params['meme_image_description'] = data['description']
@@ -46,68 +82,51 @@ class GenerationModule(ABC):
 
 
 class BaselineGenerationModule(GenerationModule):
-    def __init__(self, ablation_input: AblationInput, params, parse):
-        super().__init__(ablation_input, params, parse)
+    def __init__(self, ablation_input: AblationInput, params, parse, max_workers: int = 1):
+        super().__init__(ablation_input, params, parse, max_workers)
         logger.info("BaselineGenerationModule initialized")
 
     def generate_captions(self, num_memes: int, model: str, prompt_type: str) -> List[Meme]:
-        memes = []
         meme_images = self.input.get_meme_images()
 
         iterations = len(meme_images) if len(meme_images) > 1 else num_memes
         meme_image = meme_images[0] if len(meme_images) == 1 else None
 
-        for index in range(iterations):
+        def generate_one(index):
             current_image = meme_image or meme_images[index]
             params = self.input.to_dict()
             params['meme_image'] = current_image.to_dict()
 
-            meme_captions = self.model_manager.inference_model(model, prompt_type, params)
-
-            if not meme_captions:
-                print(f'Failed attempt to generate captions for {current_image}.')
-                continue
-
-            memes.append(Meme(
-                meme_image=current_image,
-                captions=meme_captions
-            ))
+            return current_image, self.model_manager.inference_model(model, prompt_type, params)
 
-        return memes
+        return self._generate_memes(iterations, generate_one)
 
 
 class RAGGenerationModule(GenerationModule):
-    def __init__(self, ablation_input: AblationInput, selection_module: SelectionModule, params, parse):
-        super().__init__(ablation_input, params, parse)
+    def __init__(self, ablation_input: AblationInput, selection_module: SelectionModule, params, parse,
+                 max_workers: int = 1):
+        super().__init__(ablation_input, params, parse, max_workers)
         self.selection_module = selection_module
         logger.info("RagGenerationModule initialized")
 
     def generate_captions(self, num_memes: int, model: str, prompt_type: str) -> List[Meme]:
-        memes = []
         retrieved_data = self.selection_module.rag(num_memes=num_memes)
         if not retrieved_data:
             logger.error("RAG could not retrieve data.")
-            return memes
+            return []
 
-        for index in range(num_memes):
+        def generate_one(index):
             iteration_params = self.input.to_dict().copy()
             iteration_params, current_image = self._prepare_generation_params(retrieved_data, index, iteration_params)
-            meme_captions = self.model_manager.inference_model(model, prompt_type, iteration_params)
+            return current_image, self.model_manager.inference_model(model, prompt_type, iteration_params)
 
-            if not meme_captions:
-                print(f'Failed attempt to generate captions for {current_image}.')
-                continue
-
-            memes.append(Meme(
-                meme_image=current_image,
-                captions=meme_captions
-            ))
-        return memes
+        return self._generate_memes(num_memes, generate_one)
 
 
 class DebateGenerationModule(GenerationModule):
-    def __init__(self, ablation_input: AblationInput, selection_module: SelectionModule, generators, evaluators, params, parse):
-        super().__init__(ablation_input, params, parse)
+    def __init__(self, ablation_input: AblationInput, selection_module: SelectionModule, generators, evaluators, params, parse,
+                 max_workers: int = 1):
+        super().__init__(ablation_input, params, parse, max_workers)
         self.selection_module = selection_module
         self.generators = generators
         self.evaluators = evaluators
@@ -115,23 +134,14 @@ class DebateGenerationModule(GenerationModule):
         logger.info("DebateGenerationModule initialized")
 
     def generate_captions(self, num_memes: int, model: str, prompt_type: str) -> List[Meme]:
-        memes = []
         retrieved_data = self.selection_module.rag(num_memes=num_memes)
         if not retrieved_data:
             logger.error("RAG could not retrieve data.")
-            return memes
+            return []
 
-        for index in range(num_memes):
+        def generate_one(index):
             iteration_params = self.input.to_dict().copy()
             iteration_params, current_image = self._prepare_generation_params(retrieved_data, index, iteration_params)
-            meme_captions = self.debate_manager.run_debate(iteration_params)
-
-            if not meme_captions:
-                print(f'Failed attempt to generate captions for {current_image}.')
-                continue
+            return current_image, self.debate_manager.run_debate(iteration_params)
 
-            memes.append(Meme(
-                meme_image=current_image,
-                captions=meme_captions
-            ))
-        return memes
+        return self._generate_memes(num_memes, generate_one)
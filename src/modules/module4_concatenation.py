@@ -1,5 +1,8 @@
+import asyncio
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from typing import List
+from utils.http_transport import AsyncHttpTransport
 from utils.img_flip_api import ImgFlipAPI
 from dotenv import load_dotenv
 from data.schemas import Meme
@@ -18,25 +21,39 @@ class ConcatenationModule:
         logger.info("ConcatenationModule initialized")
 
     def generate_memes(self, memes: List[Meme]) -> List[Meme]:
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return asyncio.run(self.generate_memes_async(memes))
 
-        updated_memes = memes
+        # asyncio.run refuses to start inside a running event loop (e.g. a notebook), so the memes are captioned
+        # on a fresh loop in a worker thread; async callers should await generate_memes_async instead.
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            return executor.submit(asyncio.run, self.generate_memes_async(memes)).result()
 
-        for meme in updated_memes:
-            meme_image = meme.get_meme_image()
-            meme_captions = meme.get_captions()
-            url = meme.get_url()
+    async def generate_memes_async(self, memes: List[Meme]) -> List[Meme]:
+        updated_memes = memes
 
-            if url:
-                print(f'The meme has already an upload url {url}.')
-            else:
-                response = self.img_flip_api.caption_meme_image(meme_image_id=meme_image.get_id(),
-                                                                captions=meme_captions)
-                if response.get_is_success():
-                    data = response.get_data()
-                    meme.set_url(data['url'])
-                    print(f'Meme upload url: {data['url']}')
-                else:
-                    print(f'Failed creating meme {meme_image.get_id()} with error: {response.get_message()}')
-                    continue
+        # Memes are captioned concurrently over one pooled connection instead of one request after the other.
+        async with AsyncHttpTransport.from_config() as transport:
+            await asyncio.gather(*(self._caption_meme(transport, meme) for meme in updated_memes))
 
         return updated_memes
+
+    async def _caption_meme(self, transport: AsyncHttpTransport, meme: Meme):
+        meme_image = meme.get_meme_image()
+        meme_captions = meme.get_captions()
+        url = meme.get_url()
+
+        if url:
+            print(f'The meme has already an upload url {url}.')
+        else:
+            response = await self.img_flip_api.caption_meme_image_async(transport,
+                                                                        meme_image_id=meme_image.get_id(),
+                                                                        captions=meme_captions)
+            if response.get_is_success():
+                data = response.get_data()
+                meme.set_url(data['url'])
+                print(f'Meme upload url: {data['url']}')
+            else:
+                print(f'Failed creating meme {meme_image.get_id()} with error: {response.get_message()}')
@@ -1,3 +1,3 @@
-__all__ = ['knowledge_graph', 'vector_db']
+__all__ = ['knowledge_graph', 'vector_db', 'embedding_store', 'numpy_index', 'embedding_cache', 'bm25', 'triple_store']
 
 
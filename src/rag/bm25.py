@@ -0,0 +1,90 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import tempfile
+from collections import Counter
+from pathlib import Path
+import numpy as np
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+_TOKEN_PATTERN = re.compile(r'[a-z0-9]+')
+
+
+def tokenize(text: str):
+    return _TOKEN_PATTERN.findall(text.lower())
+
+
+def fingerprint(ids, documents, k1: float, b: float) -> str:
+    """Identifies what an index was built from; ids alone miss documents changed in place and new k1/b."""
+    return hashlib.sha256(json.dumps([list(ids), list(documents), k1, b]).encode('utf-8')).hexdigest()
+
+
+class BM25Index:
+    """Okapi BM25 over a fixed document set, stored as a term-major CSR matrix of precomputed term weights.
+
+    Row t of the matrix holds, for every document containing term t, idf(t) * tf * (k1 + 1) /
+    (tf + k1 * (1 - b + b * len / avg_len)), so scoring a query only sums the rows of its terms.
+    """
+
+    def __init__(self, ids, vocabulary, indptr, indices, data, fingerprint=''):
+        self.ids = list(ids)
+        self.fingerprint = fingerprint
+        self.vocabulary = vocabulary
+        self.indptr = indptr
+        self.indices = indices
+        self.data = data
+
+    @classmethod
+    def build(cls, ids, documents, k1: float = 1.5, b: float = 0.75):
+        counts = [Counter(tokenize(document)) for document in documents]
+        lengths = np.array([sum(c.values()) for c in counts], dtype=np.float32)
+        avg_length = lengths.mean() if len(lengths) and lengths.mean() > 0 else 1.0
+
+        vocabulary = {}
+        postings = []
+        for doc, c in enumerate(counts):
+            for term, tf in c.items():
+                postings.append((vocabulary.setdefault(term, len(vocabulary)), doc, tf))
+
+        postings = np.array(postings, dtype=np.float64).reshape(-1, 3)
+        order = np.lexsort((postings[:, 1], postings[:, 0]))
+        terms, docs, tfs = postings[order, 0].astype(np.int64), postings[order, 1].astype(np.int32), postings[order, 2]
+
+        document_frequency = np.bincount(terms, minlength=len(vocabulary))
+        idf = np.log(1 + (len(documents) - document_frequency + 0.5) / (document_frequency + 0.5))
+        norm = k1 * (1 - b + b * lengths[docs] / avg_length)
+        data = (idf[terms] * tfs * (k1 + 1) / (tfs + norm)).astype(np.float32)
+        indptr = np.concatenate([[0], np.cumsum(document_frequency)]).astype(np.int64)
+        return cls(ids, vocabulary, indptr, docs, data, fingerprint(ids, documents, k1, b))
+
+    @classmethod
+    def load(cls, path: Path):
+        with np.load(path) as npz:
+            terms = npz['terms'].tolist()
+            return cls(npz['ids'].tolist(), {term: i for i, term in enumerate(terms)},
+                       npz['indptr'], npz['indices'], npz['data'],
+                       str(npz['fingerprint']) if 'fingerprint' in npz else '')
+
+    def save(self, path: Path):
+        path = Path(path)
+        terms = sorted(self.vocabulary, key=self.vocabulary.get)
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix='.npz')
+        with os.fdopen(fd, 'wb') as file:
+            np.savez(file, ids=np.asarray(self.ids, dtype=str), terms=np.asarray(terms, dtype=str),
+                     indptr=self.indptr, indices=self.indices, data=self.data, fingerprint=self.fingerprint)
+        os.replace(tmp_path, path)
+
+    def scores(self, query_texts):
+        """Returns a (queries x documents) matrix of BM25 scores."""
+        scores = np.zeros((len(query_texts), len(self.ids)), dtype=np.float32)
+        for row, text in enumerate(query_texts):
+            terms = [self.vocabulary[t] for t in set(tokenize(text)) if t in self.vocabulary]
+            if not terms:
+                continue
+            postings = np.concatenate([np.arange(self.indptr[t], self.indptr[t + 1]) for t in terms])
+            scores[row] = np.bincount(self.indices[postings], weights=self.data[postings], minlength=len(self.ids))
+        return scores
@@ -0,0 +1,142 @@
+import hashlib
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional
+import numpy as np
+from utils.helpers import get_git_root, load_config
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def normalize_query_text(text: str) -> str:
+    return ' '.join(text.split())
+
+
+class EmbeddingCache:
+    """Bounded cache of query embeddings: an in-memory LRU over an optional SQLite tier.
+
+    Keys hash the embedding model name together with the whitespace-normalized text, so changing the
+    model never serves stale vectors. The SQLite tier drops expired rows and then the least recently used
+    ones beyond max_disk_entries whenever a vector is added.
+    """
+
+    def __init__(self, model_name: str, max_entries: int = 1024, path: Optional[Path] = None,
+                 max_disk_entries=None, max_age_days=None):
+        self.model_name = model_name
+        self.max_entries = max_entries
+        self.max_disk_entries = max_disk_entries
+        self.max_age_seconds = max_age_days * 24 * 60 * 60 if max_age_days else None
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+        self.connection = None
+
+        if path:
+            path = Path(path)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            self.connection = sqlite3.connect(str(path), check_same_thread=False)
+            self.connection.execute("""
+                CREATE TABLE IF NOT EXISTS embeddings (
+                    key TEXT PRIMARY KEY,
+                    vector BLOB NOT NULL,
+                    created_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL
+                )""")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS embeddings_accessed_at ON embeddings (accessed_at)")
+            self.connection.commit()
+            with self.lock:
+                self._evict_locked()
+
+    @classmethod
+    def from_config(cls, model_name: str):
+        config = load_config('retrieval.yaml').get('query_cache', {})
+        path = config.get('path', 'data/cache/query_embeddings.sqlite')
+        return cls(model_name=model_name,
+                   max_entries=config.get('max_entries', 1024),
+                   path=get_git_root() / path if config.get('disk', True) else None,
+                   max_disk_entries=config.get('max_disk_entries'),
+                   max_age_days=config.get('max_age_days'))
+
+    def _key(self, text: str) -> str:
+        return hashlib.sha256(f'{self.model_name}\n{normalize_query_text(text)}'.encode('utf-8')).hexdigest()
+
+    def _get(self, key: str):
+        with self.lock:
+            if key in self.memory:
+                self.memory.move_to_end(key)
+                return self.memory[key]
+            if self.connection:
+                row = self.connection.execute("SELECT vector, created_at FROM embeddings WHERE key = ?",
+                                              (key,)).fetchone()
+                if row and self.max_age_seconds and row[1] < time.time() - self.max_age_seconds:
+                    row = None
+                if row:
+                    self.connection.execute("UPDATE embeddings SET accessed_at = ? WHERE key = ?", (time.time(), key))
+                    self.connection.commit()
+                    vector = np.frombuffer(row[0], dtype=np.float32)
+                    self._put_in_memory(key, vector)
+                    return vector
+        return None
+
+    def _put_in_memory(self, key: str, vector):
+        self.memory[key] = vector
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_entries:
+            self.memory.popitem(last=False)
+
+    def _put(self, key: str, vector):
+        vector = np.asarray(vector, dtype=np.float32)
+        with self.lock:
+            self._put_in_memory(key, vector)
+            if self.connection:
+                now = time.time()
+                self.connection.execute(
+                    "INSERT OR REPLACE INTO embeddings (key, vector, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                    (key, vector.tobytes(), now, now))
+                self._evict_locked()
+
+    def _evict_locked(self):
+        # Expired rows go first, then the least recently used ones until the table fits max_disk_entries.
+        if self.max_age_seconds:
+            self.connection.execute("DELETE FROM embeddings WHERE created_at < ?",
+                                    (time.time() - self.max_age_seconds,))
+        if self.max_disk_entries:
+            count = self.connection.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            if count > self.max_disk_entries:
+                self.connection.execute("DELETE FROM embeddings WHERE key IN "
+                                        "(SELECT key FROM embeddings ORDER BY accessed_at LIMIT ?)",
+                                        (count - self.max_disk_entries,))
+        self.connection.commit()
+
+    def embed(self, texts, embedding_function):
+        """Returns the embeddings of texts, calling embedding_function once on the texts that are not cached."""
+        keys = [self._key(text) for text in texts]
+        vectors = [self._get(key) for key in keys]
+        missing = {}
+        for i, (key, vector) in enumerate(zip(keys, vectors)):
+            if vector is None:
+                missing.setdefault(key, []).append(i)
+
+        if missing:
+            computed = embedding_function([texts[indices[0]] for indices in missing.values()])
+            for (key, indices), vector in zip(missing.items(), computed):
+                self._put(key, vector)
+                for i in indices:
+                    vectors[i] = np.asarray(vector, dtype=np.float32)
+        return vectors
+
+
+_embedding_caches = {}
+_embedding_caches_lock = threading.Lock()
+
+
+def get_embedding_cache(model_name: str) -> EmbeddingCache:
+    """Returns the process-wide query embedding cache of an embedding model, created from config/retrieval.yaml."""
+    with _embedding_caches_lock:
+        if model_name not in _embedding_caches:
+            _embedding_caches[model_name] = EmbeddingCache.from_config(model_name)
+        return _embedding_caches[model_name]
@@ -0,0 +1,61 @@
+import hashlib
+import logging
+import os
+import tempfile
+from pathlib import Path
+import numpy as np
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def document_hash(model_name: str, document: str) -> str:
+    return hashlib.sha256(f'{model_name}\n{document}'.encode('utf-8')).hexdigest()
+
+
+class EmbeddingStore:
+    """Raw embedding matrix persisted as .npz, one float32 row per document hash.
+
+    Documents whose hash is already stored are never embedded again, so rebuilding a collection from
+    unchanged documents costs no embedding work and an interrupted build resumes where it stopped.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.rows = {}
+        self.hashes = []
+        self.matrix = np.zeros((0, 0), dtype=np.float32)
+
+        if self.path.exists():
+            with np.load(self.path) as data:
+                self.hashes = data['hashes'].tolist()
+                self.matrix = data['matrix']
+            self.rows = {h: i for i, h in enumerate(self.hashes)}
+            logger.info(f"Loaded {len(self.hashes)} stored embeddings from {self.path}.")
+
+    def __contains__(self, doc_hash: str) -> bool:
+        return doc_hash in self.rows
+
+    def __len__(self):
+        return len(self.hashes)
+
+    def get(self, doc_hashes):
+        """Returns the stored embeddings of doc_hashes as a float32 matrix, in the given order."""
+        return self.matrix[[self.rows[h] for h in doc_hashes]]
+
+    def add(self, doc_hashes, embeddings):
+        new = [(h, e) for h, e in zip(doc_hashes, embeddings) if h not in self.rows]
+        if not new:
+            return
+        vectors = np.asarray([e for _, e in new], dtype=np.float32)
+        self.matrix = vectors if not len(self.hashes) else np.vstack([self.matrix, vectors])
+        for h, _ in new:
+            self.rows[h] = len(self.hashes)
+            self.hashes.append(h)
+
+    def save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.path.parent, suffix='.npz')
+        with os.fdopen(fd, 'wb') as file:
+            np.savez(file, hashes=np.asarray(self.hashes, dtype='<U64'), matrix=self.matrix)
+        os.replace(tmp_path, self.path)
@@ -1,19 +1,18 @@
 import csv
 import logging
 import os
-import subprocess
 import re
-import time
+import numpy as np
 import pandas as pd
 import yaml
-from random import random
-from heapq import heappush, heappushpop
+from itertools import product
 from openai import OpenAI
 from rdflib import Graph, RDF
 from collections import Counter
 from pathlib import Path
 
-from utils.helpers import download_image
+from rag.triple_store import TripleStore
+from utils.helpers import download_image, get_git_root
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -25,16 +24,6 @@ Author: https://github.com/evhart
 """
 
 
-def get_git_root() -> Path:
-    try:
-        git_root = subprocess.check_output(['git', 'rev-parse', '--show-toplevel'],
-                                           stderr=subprocess.STDOUT).decode().strip()
-        return Path(git_root)
-    except subprocess.CalledProcessError:
-        print("Warning: Not in a git repository. Using current working directory.")
-        return Path.cwd()
-
-
 def load_config(config_file: str):
     git_root = get_git_root()
     path = git_root / 'config' / config_file
@@ -129,14 +118,25 @@ def prompt_gpt4o(prompt_template, row, client, no_input_image, max_retries=15):
     return {}
 
 
-def _calculate_engagement(views, upvotes, views_mean, upvotes_mean, views_std, upvotes_std):
-    if views == 0:
-        return 0
+def _calculate_engagement(views, upvotes):
+    """Engagement of every meme: 0.2 * views z-score + 0.8 * upvotes z-score, and 0 for memes without views."""
+    views_zscore = (views - views.mean()) / views.std()
+    upvotes_zscore = (upvotes - upvotes.mean()) / upvotes.std()
+    return np.where(views == 0, 0.0, 0.2 * views_zscore + 0.8 * upvotes_zscore)
+
+
+_ALT_TEXT_PATTERN = re.compile(r"^ *([^|]+) *\| *([^|]+) *\| *image tagged in *([^|]+) *\|[^|]*$", re.IGNORECASE)
+KYM_NAMESPACE = 'https://knowyourmeme.com/memes/'
+M4S_NAMESPACE = 'https://meme4.science/'
 
-    views_zscore = (views - views_mean) / views_std
-    upvotes_zscore = (upvotes - upvotes_mean) / upvotes_std
 
-    return float(0.2 * views_zscore + 0.8 * upvotes_zscore)
+def _kym_slug(template_title):
+    # The KYM meme slug of an ImgFlip template title: lowercased, spaces to dashes, without quotes and !?,
+    return re.sub(r'[!?,]', '', template_title.lower().replace(' ', '-').replace('"', ''))
+
+
+def _count(value):
+    return 0 if value == "NA" else int(value.replace(",", ""))
 
 
 def _process_captions(captions):
@@ -159,14 +159,13 @@ class Imkg:
         self.root_path = get_git_root()
         self.pre_processed_imkg_path = self.root_path / 'data' / 'imkg' / 'rdf' / 'full'
         self.processed_imkg_path = self.root_path / 'data' / 'imkg' / 'processed' / 'imkg.ttl'
+        self.snapshot_path = self.root_path / 'data' / 'imkg' / 'processed' / 'imkg_snapshot'
         self.BASE_MEME_TEMPLATE_URL = 'https://imgflip.com/s/meme/{}.jpg'
         self.client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
         self.config = load_config('imkg.yaml')
-
-        if not self.processed_imkg_path.exists():
-            self.kg = self.parse()
-        else:
-            self.kg = self.load()
+        # The graph is only needed by the queries that build the processed csvs, so it is loaded on first use.
+        self._store = None
+        self._kg = None
 
         if not (self.root_path / 'data' / 'imkg' / 'processed' / 'imkg.csv').exists():
             self.query_kg()
@@ -175,18 +174,41 @@ class Imkg:
             self.data_descriptions = pd.read_csv(
                 self.root_path / 'data' / 'imkg' / 'processed' / 'imkg_descriptions.csv')
 
-    def parse(self) -> Graph:
+    @property
+    def store(self) -> TripleStore:
+        """The binary snapshot of the graph, built from imkg.ttl, or from the raw RDF files, the first time."""
+        if self._store is None:
+            if TripleStore.exists(self.snapshot_path):
+                self._store = TripleStore(self.snapshot_path)
+            elif self._has_processed_imkg():
+                self._kg = self.load()
+                self._store = TripleStore.from_graph(self.snapshot_path, self._kg)
+            else:
+                self._store = self.parse()
+        return self._store
+
+    @property
+    def kg(self) -> Graph:
+        if self._kg is None:
+            store = self.store
+            # Building the snapshot from imkg.ttl already parsed the graph; otherwise it comes from the snapshot.
+            if self._kg is None:
+                self._kg = store.to_graph()
+        return self._kg
+
+    def _has_processed_imkg(self) -> bool:
+        return self.processed_imkg_path.exists() and self.processed_imkg_path.stat().st_size > 0
+
+    def parse(self, max_workers=None) -> TripleStore:
+        """Rebuilds the snapshot from the raw RDF files, parsed in parallel and never held as one rdflib graph."""
         logger.info("Parsing IMKG.")
-        g = Graph()
-        for subdir, _, files in os.walk(self.pre_processed_imkg_path):
-            for file in files:
-                ext = os.path.splitext(file)[-1].lower()
-                if ext in [".nt", ".ttl"]:
-                    g.parse(os.path.join(subdir, file), format=ext[1::])
-                    logger.info(f"Parsed: {file}.")
-        g.serialize(self.processed_imkg_path, format="ttl")
-        logger.info(f"Serialized graph to {self.processed_imkg_path}.")
-        return g
+        files = sorted(Path(subdir) / file
+                       for subdir, _, files in os.walk(self.pre_processed_imkg_path)
+                       for file in files if os.path.splitext(file)[-1].lower() in [".nt", ".ttl"])
+        store = TripleStore.build_from_files(self.snapshot_path, files, max_workers=max_workers)
+        self._kg = None
+        logger.info(f"Built IMKG snapshot at {self.snapshot_path}.")
+        return store
 
     def load(self):
         g = Graph()
@@ -223,87 +245,80 @@ class Imkg:
         print(f"Unique predicates: {len(predicates)}")
         print(f"Unique objects: {len(set(o for _, _, o in self.kg))}")
 
+    def _index(self, name: str) -> dict:
+        return self.store.subject_index(self.store.predicate_ids(name))
+
+    def _join(self, names):
+        """Yields (subject, values) for every subject that has all the named predicates, one row per combination
+        of their values, as the SPARQL basic graph pattern over the same predicates did."""
+        indexes = [self._index(name) for name in names]
+        subjects = set(indexes[0]).intersection(*indexes[1:]) if indexes else set()
+        for subject in sorted(subjects):
+            for objects in product(*(index[subject] for index in indexes)):
+                yield self.store.value(subject), [self.store.value(o) for o in objects]
+
+    def _kym_memes(self):
+        """Yields (kym meme IRI, about) for every KYM meme (typed kym:Meme) with an m4s:about section."""
+        types = self._index(str(RDF.type))
+        abouts = self._index(M4S_NAMESPACE + 'about')
+        meme_types = {o for o in {o for objects in types.values() for o in objects}
+                      if self.store.value(o) == KYM_NAMESPACE + 'Meme'}
+        for subject in sorted(set(types) & set(abouts)):
+            if meme_types.intersection(types[subject]):
+                for about in abouts[subject]:
+                    yield self.store.value(subject), self.store.value(about)
+
+    def _slugs(self):
+        # The slug of every template title, computed once per distinct title instead of per joined row.
+        titles = {o for objects in self._index('template_title').values() for o in objects}
+        return {title: _kym_slug(title) for title in (self.store.value(o) for o in titles)}
+
     def query_kg(self):
         logger.info("Querying IMKG.")
-        query = """
-                SELECT ?img_flip_meme ?kym_meme ?template_title ?image_url ?template_id ?view_count ?upvote_count ?alt_text ?about ?punctuation_cleaned 
-                WHERE 
-                {
-                    ?img_flip_meme ns1:template_title ?template_title ;
-                          ns1:image_url ?image_url ;
-                          ns1:templateId ?template_id ;
-                          ns1:view_count ?view_count ;
-                          ns1:upvote_count ?upvote_count ;
-                          ns1:alt_text ?alt_text .
-
-                    BIND(LCASE(?template_title) as ?lower_title)
-                    BIND(REPLACE(?lower_title, " ", "-") as ?space_cleaned)
-                    BIND(REPLACE(?space_cleaned, '"', "") as ?quotes_cleaned)  
-                    BIND(REPLACE(?quotes_cleaned, "[!?,]", "") as ?punctuation_cleaned) 
-                    BIND(IRI(CONCAT(STR(kym:), ?punctuation_cleaned)) as ?kym_meme)
-
-                    ?kym_meme a kym:Meme ; m4s:about ?about .
-                }
-                """
+        abouts = {}
+        for kym_url, about in self._kym_memes():
+            abouts.setdefault(kym_url, []).append(about)
+        slugs = self._slugs()
 
         data = []
-        res = self.kg.query(query)
-        for row in res:
-            if (match := re.search(r"^ *([^|]+) *\| *([^|]+) *\| *image tagged in *([^|]+) *\|[^|]*$",
-                                   row.alt_text.strip(),
-                                   re.IGNORECASE)):
-                captions_text = match.group(2).strip()
-                template_title = row.template_title.toPython()
-                data.append({
-                    'meme_url': row.img_flip_meme.toPython().strip(),
-                    'kym_url': row.kym_meme.toPython().strip(),
-                    'meme_image_url': row.image_url.toPython().strip(),
-                    'template_id': row.template_id.toPython().strip(),
-                    'template_title': template_title.strip(),
-                    'template_url': self.BASE_MEME_TEMPLATE_URL.format(row.punctuation_cleaned.toPython().strip()),
-                    'captions': captions_text,
-                    'about': row.about.toPython().strip(),
-                    'views': (
-                        0 if row.view_count.toPython() == "NA" else int(row.view_count.toPython().replace(",", ""))),
-                    'upvotes': (
-                        0 if row.upvote_count.toPython() == "NA" else int(
-                            row.upvote_count.toPython().replace(",", ""))),
-                })
+        names = ['template_title', 'image_url', 'templateId', 'view_count', 'upvote_count', 'alt_text']
+        for img_flip_meme, (template_title, image_url, template_id, view_count, upvote_count, alt_text) \
+                in self._join(names):
+            punctuation_cleaned = slugs[template_title]
+            kym_meme = KYM_NAMESPACE + punctuation_cleaned
+            for about in abouts.get(kym_meme, []):
+                if (match := _ALT_TEXT_PATTERN.search(alt_text.strip())):
+                    captions_text = match.group(2).strip()
+                    data.append({
+                        'meme_url': img_flip_meme.strip(),
+                        'kym_url': kym_meme.strip(),
+                        'meme_image_url': image_url.strip(),
+                        'template_id': template_id.strip(),
+                        'template_title': template_title.strip(),
+                        'template_url': self.BASE_MEME_TEMPLATE_URL.format(punctuation_cleaned.strip()),
+                        'captions': captions_text,
+                        'about': about.strip(),
+                        'views': _count(view_count),
+                        'upvotes': _count(upvote_count),
+                    })
         logger.info("Completed querying IMKG.")
 
         pd.DataFrame(data).to_csv(self.root_path / 'data' / 'imkg' / 'processed' / 'imkg.csv', index=False, header=True)
 
     def query_imkg_memes(self):
         logger.info("Querying IMKG memes.")
-        query = """
-                SELECT ?img_flip_meme ?template_title ?image_url ?view_count ?upvote_count ?alt_text
-                WHERE 
-                {
-                    ?img_flip_meme ns1:template_title ?template_title ;
-                          ns1:image_url ?image_url ;
-                          ns1:view_count ?view_count ;
-                          ns1:upvote_count ?upvote_count ;
-                          ns1:alt_text ?alt_text .
-                }
-                """
-
         data = []
-        res = self.kg.query(query)
-        for row in res:
-            if (match := re.search(r"^ *([^|]+) *\| *([^|]+) *\| *image tagged in *([^|]+) *\|[^|]*$",
-                                   row.alt_text.strip(),
-                                   re.IGNORECASE)):
+        names = ['template_title', 'image_url', 'view_count', 'upvote_count', 'alt_text']
+        for img_flip_meme, (template_title, image_url, view_count, upvote_count, alt_text) in self._join(names):
+            if (match := _ALT_TEXT_PATTERN.search(alt_text.strip())):
                 captions_text = match.group(2).strip()
                 data.append({
-                    'meme_url': row.img_flip_meme.toPython().strip(),
-                    'meme_image_url': row.image_url.toPython().strip(),
-                    'template_title': row.template_title.toPython().strip(),
+                    'meme_url': img_flip_meme.strip(),
+                    'meme_image_url': image_url.strip(),
+                    'template_title': template_title.strip(),
                     'captions': captions_text,
-                    'views': (
-                        0 if row.view_count.toPython() == "NA" else int(row.view_count.toPython().replace(",", ""))),
-                    'upvotes': (
-                        0 if row.upvote_count.toPython() == "NA" else int(
-                            row.upvote_count.toPython().replace(",", ""))),
+                    'views': _count(view_count),
+                    'upvotes': _count(upvote_count),
                 })
         logger.info("Completed querying IMKG memes.")
 
@@ -312,27 +327,17 @@ class Imkg:
 
     def query_imkg_templates(self):
         logger.info("Querying IMKG meme templates.")
-        query = """
-                SELECT DISTINCT ?template_title ?template_id ?punctuation_cleaned
-                WHERE 
-                {
-                    ?img_flip_meme ns1:template_title ?template_title ;
-                          ns1:templateId ?template_id .
-                          
-                    BIND(LCASE(?template_title) as ?lower_title)
-                    BIND(REPLACE(?lower_title, " ", "-") as ?space_cleaned)
-                    BIND(REPLACE(?space_cleaned, '"', "") as ?quotes_cleaned)  
-                    BIND(REPLACE(?quotes_cleaned, "[!?,]", "") as ?punctuation_cleaned)    
-                }
-                """
-
+        slugs = self._slugs()
         data = []
-        res = self.kg.query(query)
-        for row in res:
+        seen = set()
+        for _, (template_title, template_id) in self._join(['template_title', 'templateId']):
+            if (template_title, template_id) in seen:
+                continue
+            seen.add((template_title, template_id))
             data.append({
-                'template_title': row.template_title.toPython().strip(),
-                'template_id': row.template_id.toPython().strip(),
-                'template_url': self.BASE_MEME_TEMPLATE_URL.format(row.punctuation_cleaned.toPython().strip()),
+                'template_title': template_title.strip(),
+                'template_id': template_id.strip(),
+                'template_url': self.BASE_MEME_TEMPLATE_URL.format(slugs[template_title].strip()),
             })
         logger.info("Completed querying IMKG meme templates.")
 
@@ -341,70 +346,36 @@ class Imkg:
 
     def query_kym_memes(self):
         logger.info("Querying IMKG kym memes.")
-        query = """
-                SELECT DISTINCT ?kym_meme ?about 
-                WHERE 
-                {
-                    ?kym_meme a kym:Meme ; m4s:about ?about .  
-                }
-                """
-
         data = []
-        res = self.kg.query(query)
-        for row in res:
+        for kym_meme, about in dict.fromkeys(self._kym_memes()):
             data.append({
-                'kym_url': row.kym_meme.toPython().strip(),
-                'about': row.about.toPython().strip(),
+                'kym_url': kym_meme.strip(),
+                'about': about.strip(),
             })
         logger.info("Completed querying IMKG kym memes.")
 
         pd.DataFrame(data).to_csv(self.root_path / 'data' / 'imkg' / 'processed' / 'imkg_kym_memes.csv',
                                   index=False, header=True)
 
-    def query_templates_top_captions(self, n):
+    def query_templates_top_captions(self, n, seed=0):
+        """Keeps the n memes with the highest engagement of every template, ties broken at random with seed.
+
+        Templates are written in order of first appearance, each with its memes in ascending engagement.
+        """
         logger.info(f"Querying top {n} captions per template.")
         df = pd.read_csv(self.root_path / 'data' / 'imkg' / 'processed' / 'imkg_memes.csv')
-        views_mean = df['views'].mean()
-        upvotes_mean = df['upvotes'].mean()
-        views_std = df['views'].std()
-        upvotes_std = df['upvotes'].std()
-        data = {}
-
-        for _, row in df.iterrows():
-            template_title = row['template_title']
-            engagement = _calculate_engagement(row['views'], row['upvotes'], views_mean, upvotes_mean, views_std,
-                                               upvotes_std)
-            meme_data = {
-                'meme_url': row['meme_url'],
-                'views': row['views'],
-                'upvotes': row['upvotes'],
-                'captions': row['captions'],
-                'engagement': engagement,
-            }
-            if template_title not in data:
-                data[template_title] = []
-
-            if len(data[template_title]) < n:
-                heappush(data[template_title], (meme_data['engagement'], random(), meme_data))
-            else:
-                heappushpop(data[template_title], (meme_data['engagement'], random(), meme_data))
-
-        rows = []
-        for template, heap in data.items():
-            sorted_memes = sorted(heap, key=lambda x: x[0])
-            for meme in sorted_memes:
-                rows.append({
-                    'template_title': template,
-                    'meme_url': meme[2]['meme_url'],
-                    'views': meme[2]['views'],
-                    'upvotes': meme[2]['upvotes'],
-                    'engagement': meme[2]['engagement'],
-                    'captions': meme[2]['captions']
-                })
-
-        pd.DataFrame(rows).to_csv(
-            self.root_path / 'data' / 'imkg' / 'processed' / f'imkg_top_{n}_captions_per_template.csv',
-            index=False, header=True)
+        df['engagement'] = _calculate_engagement(df['views'], df['upvotes'])
+        df['tie_break'] = np.random.default_rng(seed).random(len(df))
+        df['template_order'] = pd.factorize(df['template_title'], use_na_sentinel=False)[0]
+
+        top = (df.sort_values(['engagement', 'tie_break'], ascending=False, kind='stable')
+               .groupby('template_title', sort=False, dropna=False)
+               .head(n))
+        top = top.sort_values(['template_order', 'engagement', 'tie_break'], kind='stable')
+
+        top.to_csv(self.root_path / 'data' / 'imkg' / 'processed' / f'imkg_top_{n}_captions_per_template.csv',
+                   index=False, header=True,
+                   columns=['template_title', 'meme_url', 'views', 'upvotes', 'engagement', 'captions'])
         logger.info(f"Completed querying top {n} captions per template.")
 
     def generate_image_descriptions(self):
@@ -517,19 +488,16 @@ class Imkg:
         df = pd.read_csv(self.root_path / 'data' / 'imkg' / 'processed' / 'imkg_final_deduplicated_proccessed.csv',
                          delimiter=',')
         imkg = pd.read_csv(self.root_path / 'data' / 'imkg' / 'processed' / 'imkg.csv', delimiter=',')
-        nrows = len(df)
-        for index, row in df.iterrows():
-            start = time.time()
-            template_title = row['template_title']
-            for _, row_imkg in imkg.iterrows():
-                if row_imkg['template_title'] == template_title:
-                    about = row_imkg['about']
-                    df.at[index, 'about'] = about
-                    break
-            finish = time.time()
-            nrows -= 1
-            print(f"Processed {template_title} in {finish - start} seconds. {nrows} rows left.")
-            print(f'Estimated time left: {nrows * (finish - start) / 60} minutes.')
+
+        # One lookup table from title to the about section of its first imkg.csv row, instead of scanning imkg.csv
+        # per template. Titles match exactly, as before, and templates without a match keep their about section.
+        about_by_title = (imkg.dropna(subset=['template_title'])
+                          .drop_duplicates(subset='template_title', keep='first')
+                          .set_index('template_title')['about'])
+        matched = df['template_title'].isin(about_by_title.index)
+        df['about'] = df['about'].astype(object) if 'about' in df.columns else None
+        df.loc[matched, 'about'] = df.loc[matched, 'template_title'].map(about_by_title)
+        logger.info(f"Added the KYM about section to {matched.sum()} of {len(df)} templates.")
 
         columns = ['template_id', 'template_url', 'template_title', 'total_views', 'total_upvotes', 'about', 'captions',
                    'description', 'caption_style_explanation']
@@ -0,0 +1,147 @@
+import json
+import logging
+import os
+import tempfile
+from pathlib import Path
+import numpy as np
+from rag.bm25 import BM25Index, fingerprint
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def _normalize(matrix):
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    return matrix / np.where(norms == 0, 1, norms)
+
+
+class NumpyIndex:
+    """Exact in-process vector index: a memory-mapped float32 matrix of normalized embeddings and a metadata table.
+
+    The index directory holds embeddings.npy (one row per id) and metadata.json (ids, metadatas and documents
+    in row order). Scores are cosine similarities, which rank like Chroma's L2 distance on normalized
+    embeddings. With lexical scoring enabled, a BM25 index over the same documents is kept in bm25.npz.
+    """
+
+    def __init__(self, path: Path, lexical: bool = False, k1: float = 1.5, b: float = 0.75):
+        self.path = Path(path)
+        self.lexical = lexical
+        self.k1 = k1
+        self.b = b
+        self._load()
+
+    def _load(self):
+        self.matrix = np.load(self.path / 'embeddings.npy', mmap_mode='r')
+        with open(self.path / 'metadata.json', encoding='utf-8') as file:
+            table = json.load(file)
+        self.ids = table['ids']
+        self.metadatas = table['metadatas']
+        self.documents = table.get('documents', [''] * len(self.ids))
+        self.rows = {id: i for i, id in enumerate(self.ids)}
+        self.bm25 = self._load_bm25() if self.lexical else None
+        logger.info(f"Loaded numpy index with {len(self.ids)} entries from {self.path}.")
+
+    def _load_bm25(self):
+        bm25_path = self.path / 'bm25.npz'
+        if bm25_path.exists():
+            bm25 = BM25Index.load(bm25_path)
+            if bm25.fingerprint == fingerprint(self.ids, self.documents, self.k1, self.b):
+                return bm25
+        # Missing, or written for other documents (upsert keeps the ids of changed ones) or another k1/b.
+        bm25 = BM25Index.build(self.ids, self.documents, self.k1, self.b)
+        bm25.save(bm25_path)
+        return bm25
+
+    @staticmethod
+    def exists(path: Path) -> bool:
+        return (Path(path) / 'embeddings.npy').exists() and (Path(path) / 'metadata.json').exists()
+
+    @classmethod
+    def build(cls, path: Path, ids, embeddings, metadatas, documents=None, **kwargs):
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        ids = list(ids)
+        cls._write(path, ids, _normalize(embeddings), list(metadatas), list(documents or [''] * len(ids)))
+        return cls(path, **kwargs)
+
+    @staticmethod
+    def _write(path: Path, ids, matrix, metadatas, documents):
+        # Both files are replaced atomically so a reader never sees a half-written index.
+        fd, tmp_path = tempfile.mkstemp(dir=path, suffix='.npy')
+        with os.fdopen(fd, 'wb') as file:
+            np.save(file, matrix)
+        os.replace(tmp_path, path / 'embeddings.npy')
+
+        fd, tmp_path = tempfile.mkstemp(dir=path, suffix='.json')
+        with os.fdopen(fd, 'w', encoding='utf-8') as file:
+            json.dump({'ids': ids, 'metadatas': metadatas, 'documents': documents}, file, ensure_ascii=False)
+        os.replace(tmp_path, path / 'metadata.json')
+
+    def __len__(self):
+        return len(self.ids)
+
+    def get(self, id):
+        row = self.rows.get(id)
+        return self.metadatas[row] if row is not None else None
+
+    def scores(self, embeddings):
+        """Returns the (queries x entries) cosine similarity matrix of embeddings against the index."""
+        embeddings = np.atleast_2d(np.asarray(embeddings, dtype=np.float32))
+        if not len(self.ids):
+            return np.zeros((len(embeddings), 0), dtype=np.float32)
+        return _normalize(embeddings) @ self.matrix.T
+
+    def lexical_scores(self, query_texts):
+        return self.bm25.scores(query_texts)
+
+    def top_k(self, scores, nresults=1):
+        """Returns one (ids, metadatas) pair per row of scores, holding the nresults best entries, best first."""
+        k = min(nresults, len(self.ids))
+        if k <= 0:
+            return [([], []) for _ in scores]
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        top = np.take_along_axis(top, np.argsort(-top_scores, axis=1, kind='stable'), axis=1)
+        return [([self.ids[i] for i in row], [self.metadatas[i] for i in row]) for row in top]
+
+    def query(self, embedding, nresults=1):
+        """Returns the ids and metadatas of the nresults entries most similar to embedding, best first."""
+        return self.query_many([embedding], nresults)[0]
+
+    def query_many(self, embeddings, nresults=1):
+        """Batched query: one matrix product and one argpartition for all embeddings, one (ids, metadatas) each."""
+        return self.top_k(self.scores(embeddings), nresults)
+
+    def upsert(self, ids, embeddings, metadatas, documents):
+        """Adds or replaces entries and rewrites the index files once."""
+        matrix = np.array(self.matrix)
+        vectors = _normalize(embeddings)
+        all_ids, all_metadatas, all_documents = list(self.ids), list(self.metadatas), list(self.documents)
+        rows = dict(self.rows)
+        new_vectors = []
+        for id, vector, metadata, document in zip(ids, vectors, metadatas, documents):
+            if id in rows:
+                if rows[id] < len(matrix):
+                    matrix[rows[id]] = vector
+                else:
+                    new_vectors[rows[id] - len(matrix)] = vector
+                all_metadatas[rows[id]] = metadata
+                all_documents[rows[id]] = document
+            else:
+                rows[id] = len(all_ids)
+                all_ids.append(id)
+                all_metadatas.append(metadata)
+                all_documents.append(document)
+                new_vectors.append(vector)
+        if new_vectors:
+            matrix = np.vstack([matrix, new_vectors]) if len(matrix) else np.asarray(new_vectors, dtype=np.float32)
+        self._write(self.path, all_ids, matrix, all_metadatas, all_documents)
+        self._load()
+
+    def delete(self, ids):
+        ids = set(ids)
+        keep = [i for i, id in enumerate(self.ids) if id not in ids]
+        self._write(self.path, [self.ids[i] for i in keep], np.array(self.matrix[keep]),
+                    [self.metadatas[i] for i in keep], [self.documents[i] for i in keep])
+        self._load()
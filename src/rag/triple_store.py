@@ -0,0 +1,211 @@
+import json
+import logging
+import mmap
+import os
+import tempfile
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+import numpy as np
+from rdflib import BNode, Graph, Literal, URIRef
+from rdflib.plugins.parsers.ntriples import W3CNTriplesParser
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+_SEPARATOR = '\x1f'
+
+
+def encode_term(term) -> str:
+    """Encodes an rdflib term as a kind-prefixed string: 'U' + IRI, 'B' + blank node id, or for literals
+    'L' + datatype, language and lexical form separated by \\x1f (the lexical form last, as it is free text)."""
+    if isinstance(term, Literal):
+        return f"L{term.datatype or ''}{_SEPARATOR}{term.language or ''}{_SEPARATOR}{term}"
+    if isinstance(term, BNode):
+        return f'B{term}'
+    return f'U{term}'
+
+
+def decode_term(key: str):
+    kind, value = key[0], key[1:]
+    if kind == 'L':
+        datatype, language, lexical = value.split(_SEPARATOR, 2)
+        return Literal(lexical, lang=language or None, datatype=URIRef(datatype) if datatype else None)
+    if kind == 'B':
+        return BNode(value)
+    return URIRef(value)
+
+
+class _InterningSink:
+    """N-Triples parser sink that keeps only interned term ids, never the parsed terms themselves."""
+
+    def __init__(self):
+        self.ids = {}
+        self.rows = array('i')
+
+    def triple(self, s, p, o):
+        for term in (s, p, o):
+            self.rows.append(self.ids.setdefault(encode_term(term), len(self.ids)))
+
+
+def parse_file(path):
+    """Parses one RDF file into its encoded terms, an (n x 3) int32 array of ids into them and its prefix bindings.
+
+    N-Triples are streamed line by line, so memory grows with the distinct terms and not with a graph. Turtle
+    goes through an rdflib graph of that file alone. Blank nodes get fresh ids per file, as they would when
+    the files are parsed into one graph. Runs in the worker processes of TripleStore.build_from_files.
+    """
+    path = Path(path)
+    sink = _InterningSink()
+    namespaces = []
+    if path.suffix.lower() == '.nt':
+        with open(path, 'rb') as file:
+            W3CNTriplesParser(sink).parse(file, bnode_context={})
+    else:
+        graph = Graph()
+        graph.parse(path, format=path.suffix.lower()[1:])
+        for triple in graph:
+            sink.triple(*triple)
+        namespaces = [(prefix, str(namespace)) for prefix, namespace in graph.namespaces()]
+    return list(sink.ids), np.frombuffer(sink.rows, dtype=np.int32).reshape(-1, 3), namespaces
+
+
+class TripleStore:
+    """Read-only binary snapshot of an RDF graph: every distinct term interned once and triples as integer ids.
+
+    The snapshot directory holds terms.bin (the UTF-8 encoded terms, concatenated), offsets.npy (int64 start
+    of every term in terms.bin, plus the end), triples.npy (int32 subject, predicate and object ids, one row
+    per distinct triple, sorted by predicate, subject and object) and namespaces.json (the prefix bindings
+    SPARQL queries rely on). The arrays and the term blob are memory-mapped, so opening a snapshot reads
+    nothing but its headers and terms are decoded only when asked for.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.offsets = np.load(self.path / 'offsets.npy', mmap_mode='r')
+        self.triples = np.load(self.path / 'triples.npy', mmap_mode='r')
+        with open(self.path / 'namespaces.json', encoding='utf-8') as file:
+            self.namespaces = json.load(file)
+        self._predicates = None
+        self.blob = b''
+        if (self.path / 'terms.bin').stat().st_size:
+            with open(self.path / 'terms.bin', 'rb') as file:
+                self.blob = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        logger.info(f"Opened triple store with {len(self.triples)} triples and {self.num_terms} terms "
+                    f"from {self.path}.")
+
+    @staticmethod
+    def exists(path: Path) -> bool:
+        return all((Path(path) / name).exists()
+                   for name in ['terms.bin', 'offsets.npy', 'triples.npy', 'namespaces.json'])
+
+    @classmethod
+    def build(cls, path: Path, triples, namespaces=()):
+        """Interns the terms of triples (rdflib (subject, predicate, object) tuples) and writes a snapshot."""
+        ids = {}
+        rows = [(ids.setdefault(encode_term(s), len(ids)),
+                 ids.setdefault(encode_term(p), len(ids)),
+                 ids.setdefault(encode_term(o), len(ids))) for s, p, o in triples]
+        return cls.write(path, list(ids), np.asarray(rows, dtype=np.int32).reshape(-1, 3), namespaces)
+
+    @classmethod
+    def from_graph(cls, path: Path, graph: Graph):
+        return cls.build(path, graph, [(prefix, str(namespace)) for prefix, namespace in graph.namespaces()])
+
+    @classmethod
+    def build_from_files(cls, path: Path, files, max_workers=None):
+        """Parses RDF files in a process pool and merges them into one snapshot.
+
+        Each worker interns the terms of its own file; the merge maps those local ids to global ones, so only
+        term strings and integer arrays ever reach this process.
+        """
+        files = [Path(file) for file in files]
+        terms = {}
+        namespaces = {}
+        chunks = []
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            for file, (file_terms, triples, file_namespaces) in zip(files, executor.map(parse_file, files)):
+                remap = np.fromiter((terms.setdefault(term, len(terms)) for term in file_terms),
+                                    dtype=np.int32, count=len(file_terms))
+                chunks.append(remap[triples])
+                for prefix, namespace in file_namespaces:
+                    namespaces.setdefault(prefix, namespace)
+                logger.info(f"Parsed: {file.name} ({len(triples)} triples).")
+        triples = np.concatenate(chunks) if chunks else np.zeros((0, 3), dtype=np.int32)
+        return cls.write(path, list(terms), triples, namespaces.items())
+
+    @classmethod
+    def write(cls, path: Path, terms, triples, namespaces=()):
+        """Writes a snapshot from encoded terms and an (n x 3) array of term ids; duplicate triples are dropped."""
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        triples = np.unique(np.asarray(triples, dtype=np.int32).reshape(-1, 3), axis=0)
+        triples = triples[np.lexsort((triples[:, 2], triples[:, 0], triples[:, 1]))]
+        encoded = [term.encode('utf-8') for term in terms]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(term) for term in encoded], out=offsets[1:])
+
+        # Every file is replaced atomically so a reader never sees a half-written snapshot.
+        cls._replace(path / 'terms.bin', '.bin', lambda file: file.write(b''.join(encoded)))
+        cls._replace(path / 'offsets.npy', '.npy', lambda file: np.save(file, offsets))
+        cls._replace(path / 'triples.npy', '.npy', lambda file: np.save(file, triples))
+        cls._replace(path / 'namespaces.json', '.json',
+                     lambda file: file.write(json.dumps([list(n) for n in namespaces]).encode('utf-8')))
+        logger.info(f"Wrote triple store with {len(triples)} triples and {len(terms)} terms to {path}.")
+        return cls(path)
+
+    @staticmethod
+    def _replace(target: Path, suffix: str, write):
+        fd, tmp_path = tempfile.mkstemp(dir=target.parent, suffix=suffix)
+        with os.fdopen(fd, 'wb') as file:
+            write(file)
+        os.replace(tmp_path, target)
+
+    @property
+    def num_terms(self) -> int:
+        return len(self.offsets) - 1
+
+    def __len__(self):
+        return len(self.triples)
+
+    def key(self, term_id: int) -> str:
+        return self.blob[self.offsets[term_id]:self.offsets[term_id + 1]].decode('utf-8')
+
+    def term(self, term_id: int):
+        return decode_term(self.key(term_id))
+
+    def value(self, term_id: int) -> str:
+        """The IRI, blank node id or lexical form of a term, as a string."""
+        key = self.key(term_id)
+        return key[1:].split(_SEPARATOR, 2)[2] if key[0] == 'L' else key[1:]
+
+    def predicate_ids(self, name: str):
+        """Ids of the predicates whose IRI is name, or whose local name (after the last '/' or '#') is name."""
+        if self._predicates is None:
+            column = self.triples[:, 1]
+            # The triples are sorted by predicate, so the distinct predicates are where the column changes.
+            starts = np.flatnonzero(np.diff(column, prepend=-1)) if len(column) else []
+            self._predicates = {int(column[i]): self.value(int(column[i])) for i in starts}
+        return [p for p, iri in self._predicates.items()
+                if iri == name or iri.rsplit('/', 1)[-1].rsplit('#', 1)[-1] == name]
+
+    def subject_index(self, predicate_ids) -> dict:
+        """Maps every subject of the given predicates to the list of its object ids."""
+        column = self.triples[:, 1]
+        index = {}
+        for predicate in predicate_ids:
+            start, end = np.searchsorted(column, [predicate, predicate + 1])
+            rows = np.asarray(self.triples[start:end])
+            for subject, obj in zip(rows[:, 0].tolist(), rows[:, 2].tolist()):
+                index.setdefault(subject, []).append(obj)
+        return index
+
+    def to_graph(self) -> Graph:
+        """Rebuilds the rdflib graph, for SPARQL queries; no Turtle is parsed."""
+        graph = Graph()
+        for prefix, namespace in self.namespaces:
+            graph.bind(prefix, namespace, override=True, replace=True)
+        terms = [self.term(i) for i in range(self.num_terms)]
+        for s, p, o in self.triples:
+            graph.add((terms[s], terms[p], terms[o]))
+        return graph
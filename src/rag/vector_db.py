@@ -1,76 +1,226 @@
+import hashlib
+import json
 import logging
+import os
+import tempfile
+import threading
 import chromadb
+import numpy as np
 import pandas as pd
+from chromadb.utils.embedding_functions import DefaultEmbeddingFunction
+from tqdm import tqdm
 
+from rag.embedding_cache import get_embedding_cache
+from rag.embedding_store import EmbeddingStore, document_hash
 from rag.knowledge_graph import get_git_root
+from rag.numpy_index import NumpyIndex
+from utils.helpers import load_config
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+METADATA_COLUMNS = ['description', 'captions', 'caption_style_explanation', 'box_count', 'template_title',
+                    'template_url', 'total_views', 'total_upvotes', 'about']
+
+
+def _build_documents(df):
+    """Builds the document text of every template row with column operations instead of a per-row loop."""
+    has_about = df['about'].notna()
+    about_part = ('Meme KnowYourMeme about section: ' + df['about'].astype(str) + '\n\n').where(has_about, '')
+    return ('Meme Template Name: ' + df['template_title'].astype(str) + '\n\n'
+            + about_part
+            + 'Meme Template/Image Visual Description: ' + df['description'].astype(str) + '\n\n'
+            + 'Meme Captioning Style: ' + df['caption_style_explanation'].astype(str) + '\n\n'
+            + 'Meme Number of Placeholders/Boxes/Captions to Fill: ' + df['box_count'].astype(str)).tolist()
+
+
+def _build_metadatas(df):
+    records = df[METADATA_COLUMNS].rename(columns={'template_url': 'url'}).to_dict('records')
+    for record in records:
+        if pd.isna(record['about']):
+            del record['about']
+    return records
+
+
+def _row_hash(document, metadata):
+    payload = json.dumps({'document': document, 'metadata': metadata}, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def _min_max(scores):
+    low = scores.min(axis=1, keepdims=True)
+    spread = scores.max(axis=1, keepdims=True) - low
+    return (scores - low) / np.where(spread == 0, 1, spread)
+
+
+def _fuse(dense_scores, lexical_scores, lexical_weight):
+    """Blends min-max normalized dense and BM25 scores, so neither scale dominates the other."""
+    if not dense_scores.size:
+        return dense_scores
+    return (1 - lexical_weight) * _min_max(dense_scores) + lexical_weight * _min_max(lexical_scores)
+
 
 class VectorDB:
-    def __init__(self, name='meme_fact_vector_db'):
+    def __init__(self, name=None, retrieval_config=None):
+        # retrieval_config defaults to config/retrieval.yaml; the retrieval benchmark passes its own variants.
+        retrieval_config = retrieval_config or load_config('retrieval.yaml')
+        self.config = retrieval_config['vector_db']
+        name = name or self.config['collection']
         self.root_path = get_git_root()
         self.processed_data = self.root_path / 'data' / 'imkg' / 'processed' / 'imkg_final_final_final_processor.csv'
         self.vector_db_path = self.root_path / 'data' / 'vector_db'
 
         self.vector_db_path.mkdir(parents=True, exist_ok=True)
-        self.client = chromadb.PersistentClient(path=str(self.vector_db_path))
+        self.backend = self.config.get('backend', 'chroma')
+        self.embedding_function = DefaultEmbeddingFunction()
+        self.embedding_store_path = self.vector_db_path / f'{name}_embeddings.npz'
+        # One manifest per backend: each one describes what its own store holds.
+        self.manifest_path = self.vector_db_path / f'{name}_{self.backend}_manifest.json'
+        self.query_cache = None
+        if retrieval_config.get('query_cache', {}).get('enabled', True):
+            self.query_cache = get_embedding_cache(self.config.get('embedding_model', 'all-MiniLM-L6-v2'))
 
+        self.hybrid = retrieval_config.get('hybrid', {})
+        if self.hybrid.get('enabled', False) and self.backend != 'numpy':
+            raise ValueError("Hybrid retrieval needs the 'numpy' vector database backend.")
+
+        self.client = None
         self.collection = None
+        self.index = None
+        # Guards writes and the numpy index, whose arrays are swapped when it is rewritten. Embedding
+        # query texts happens outside of it, so concurrent queries only serialize on the top-k itself.
+        self.lock = threading.RLock()
+
+        if self.backend == 'numpy':
+            self._load_index(name)
+        elif self.backend == 'chroma':
+            self._load_collection(name)
+        else:
+            raise ValueError(f"Unknown vector database backend '{self.backend}'. Use 'chroma' or 'numpy'.")
 
-        try:
-            self.collection = self.client.get_collection(name)
-            logger.info(f"Loaded vector database: {name}")
-        except Exception:
-            logger.info(f"Vector database {name} not found. Creating new collection.")
-            self._create_collection(name)
+        if self._is_empty() and self.manifest_path.exists():
+            # A new or emptied store holds none of the rows its manifest lists, so everything is synced again.
+            logger.info(f"Vector database {name} is empty. Resetting its manifest.")
+            self.manifest_path.unlink()
+        if self.config.get('sync_on_load', True) or not self.manifest_path.exists():
+            self.sync()
 
-    def _create_collection(self, collection_name):
-        self.collection = self.client.create_collection(name=collection_name)
+    def _is_empty(self):
+        if self.index is not None:
+            return len(self.index) == 0
+        return self.collection.count() == 0
+
+    def _load_templates(self):
         df = pd.read_csv(self.processed_data, delimiter=',')
+        return df['template_id'].astype(str).tolist(), _build_documents(df), _build_metadatas(df)
+
+    def _load_index(self, name):
+        index_path = self.vector_db_path / f'{name}_numpy'
+        options = {'lexical': self.hybrid.get('enabled', False),
+                   'k1': self.hybrid.get('k1', 1.5),
+                   'b': self.hybrid.get('b', 0.75)}
+        if NumpyIndex.exists(index_path):
+            self.index = NumpyIndex(index_path, **options)
+        else:
+            logger.info(f"Numpy index {name} not found. Building it.")
+            self.index = NumpyIndex.build(index_path, [], np.zeros((0, 0), dtype=np.float32), [], **options)
+
+    def _load_collection(self, name):
+        self.client = chromadb.PersistentClient(path=str(self.vector_db_path))
+        self.collection = self.client.get_or_create_collection(name=name, embedding_function=self.embedding_function)
+        logger.info(f"Loaded vector database: {name}")
+
+    def _load_manifest(self):
+        if not self.manifest_path.exists():
+            return {'rows': {}, 'manual': []}
+        with open(self.manifest_path, encoding='utf-8') as file:
+            return json.load(file)
+
+    def _save_manifest(self, manifest):
+        fd, tmp_path = tempfile.mkstemp(dir=self.vector_db_path, suffix='.json')
+        with os.fdopen(fd, 'w', encoding='utf-8') as file:
+            json.dump(manifest, file)
+        os.replace(tmp_path, self.manifest_path)
+
+    def sync(self):
+        """Brings the store in line with the processed csv, touching only new, changed and removed templates.
 
-        ids = []
-        documents = []
-        metadatas = []
-
-        for _, row in df.iterrows():
-            document_parts = [
-                f"Meme Template Name: {row.template_title}",
-                f"Meme Template/Image Visual Description: {row.description}",
-                f"Meme Captioning Style: {row.caption_style_explanation}",
-                f"Meme Number of Placeholders/Boxes/Captions to Fill: {row.box_count}",
-            ]
-            if not pd.isna(row.about):
-                document_parts.insert(1, f"Meme KnowYourMeme about section: {row.about}")
-
-            document = '\n\n'.join(document_parts)
-
-            metadata = {
-                'description': row.description,
-                'captions': row.captions,
-                'caption_style_explanation': row.caption_style_explanation,
-                'box_count': row.box_count,
-                'template_title': row.template_title,
-                'url': row.template_url,
-                'total_views': row.total_views,
-                'total_upvotes': row.total_upvotes,
-            }
-
-            if not pd.isna(row.about):
-                metadata['about'] = row.about
-
-            ids.append(str(row.template_id))
-            documents.append(document)
-            metadatas.append(metadata)
-
-        self.collection.add(
+        The manifest records a hash of each template's document and metadata as last written. Entries added
+        with add_entry are kept even though the csv does not list them. Returns the number of rows changed.
+        """
+        with self.lock:
+            ids, documents, metadatas = self._load_templates()
+            manifest = self._load_manifest()
+            hashes = [_row_hash(document, metadata) for document, metadata in zip(documents, metadatas)]
+
+            changed = [i for i, (id, row_hash) in enumerate(zip(ids, hashes))
+                       if manifest['rows'].get(id) != row_hash]
+            csv_ids = set(ids)
+            manual = set(manifest['manual']) - csv_ids
+            removed = [id for id in manifest['rows'] if id not in csv_ids and id not in manual]
+            if not changed and not removed:
+                return 0
+            logger.info(f"Syncing vector database: {len(changed)} new or changed and "
+                        f"{len(removed)} removed templates.")
+
+            if removed:
+                self._delete(removed)
+                for id in removed:
+                    del manifest['rows'][id]
+            manifest['manual'] = sorted(manual)
+            self._save_manifest(manifest)
+
+            embeddings = self._embed([documents[i] for i in changed])
+            batch_size = self.config.get('embedding_batch_size', 64) if self.index is None else max(1, len(changed))
+            for start in tqdm(range(0, len(changed), batch_size),
+                              desc='Upserting templates into the vector database'):
+                batch = changed[start:start + batch_size]
+                self._upsert([ids[i] for i in batch], embeddings[start:start + batch_size],
+                             [documents[i] for i in batch], [metadatas[i] for i in batch])
+                # Saved after every batch so an interrupted sync resumes where it stopped.
+                manifest['rows'].update({ids[i]: hashes[i] for i in batch})
+                self._save_manifest(manifest)
+            return len(changed) + len(removed)
+
+    def _upsert(self, ids, embeddings, documents, metadatas):
+        if self.index is not None:
+            self.index.upsert(ids, embeddings, metadatas, documents)
+            return
+        self.collection.upsert(
             ids=ids,
+            embeddings=np.asarray(embeddings).tolist(),
             documents=documents,
             metadatas=metadatas
         )
 
+    def _delete(self, ids):
+        if self.index is not None:
+            self.index.delete(ids)
+        else:
+            self.collection.delete(ids=ids)
+
+    def _embed(self, documents):
+        """Returns the embedding matrix of documents, embedding in batches only those missing from the store."""
+        store = EmbeddingStore(self.embedding_store_path)
+        model_name = self.config.get('embedding_model', 'all-MiniLM-L6-v2')
+        hashes = [document_hash(model_name, document) for document in documents]
+        missing = [i for i, h in enumerate(hashes) if h not in store]
+        logger.info(f"Embedding {len(missing)} of {len(documents)} documents; the rest are already stored.")
+
+        batch_size = self.config.get('embedding_batch_size', 64)
+        for start in tqdm(range(0, len(missing), batch_size), desc='Embedding templates'):
+            batch = missing[start:start + batch_size]
+            store.add([hashes[i] for i in batch], self.embedding_function([documents[i] for i in batch]))
+            # Saved after every batch so an interrupted build keeps the work done so far.
+            store.save()
+        return store.get(hashes) if hashes else np.zeros((0, 0), dtype=np.float32)
+
     def _query_by_template_id(self, meme_template_id):
+        if self.index is not None:
+            with self.lock:
+                metadata = self.index.get(meme_template_id)
+            return [metadata] if metadata else None
+
         result = self.collection.get(
             ids=[meme_template_id],
             include=['metadatas']
@@ -79,7 +229,8 @@ class VectorDB:
             return [result['metadatas'][0]]
         return None
 
-    def _query_by_article_data(self, article_data, nresults):
+    @staticmethod
+    def _build_query_text(article_data):
         query_parts = [f'Claim: {article_data["claim"]}']
         if 'iytis' in article_data:
             query_parts.append(f'Summarized rationale: {article_data["iytis"]}')
@@ -92,14 +243,41 @@ class VectorDB:
         if 'iytis' in article_data and 'rationale' in article_data:
             query_parts.append(f'Summarized rationale: {article_data["iytis"]}')
             query_parts.append(f'Rationale: {article_data['rationale']}')
+        return '\n'.join(query_parts)
+
+    def _query_by_article_data(self, article_data, nresults):
+        return self._query_by_texts([self._build_query_text(article_data)], nresults)[0]
+
+    def _query_by_texts(self, query_texts, nresults):
+        # All query texts are embedded in one call and ranked in one vectorized top-k. Texts seen before
+        # (moderation retries, other models on the same article) come from the query cache instead.
+        if self.query_cache:
+            embeddings = self.query_cache.embed(query_texts, self.embedding_function)
+        else:
+            embeddings = self.embedding_function(query_texts)
+        if self.index is not None:
+            with self.lock:
+                scores = self.index.scores(embeddings)
+                if self.index.lexical:
+                    scores = _fuse(scores, self.index.lexical_scores(query_texts),
+                                   self.hybrid.get('lexical_weight', 0.3))
+                results = self.index.top_k(scores, nresults)
+            return [[{**item, 'id': id} for item, id in zip(metadatas, ids)] for ids, metadatas in results]
 
-        query_text = '\n'.join(query_parts)
         results = self.collection.query(
-            query_texts=[query_text],
+            query_embeddings=embeddings,
             n_results=nresults,
             include=['metadatas']
         )
-        return [{**item, 'id': id} for item, id in zip(results['metadatas'][0], results['ids'][0])]
+        return [[{**item, 'id': id} for item, id in zip(metadatas, ids)]
+                for metadatas, ids in zip(results['metadatas'], results['ids'])]
+
+    def query_many(self, articles_data, nresults=1):
+        """Retrieves the nresults best templates for each article in a single pass, in the order given."""
+        if not articles_data:
+            return []
+        results = self._query_by_texts([self._build_query_text(a) for a in articles_data], nresults)
+        return [ret if ret else None for ret in results]
 
     def query(self, meme_template_id, article_data=None, nresults=1):
         if meme_template_id:
@@ -135,11 +313,29 @@ class VectorDB:
         if about:
             metadata['about'] = about
 
-        self.collection.add(
-            ids=[meme_template_id],
-            documents=[document],
-            metadatas=[metadata]
-        )
+        embeddings = self.embedding_function([document])
+        with self.lock:
+            # Upserted, so re-adding a template updates it instead of failing on the existing id.
+            self._upsert([meme_template_id], embeddings, [document], [metadata])
+
+            # Marked as manual so a sync with the csv keeps it.
+            manifest = self._load_manifest()
+            if meme_template_id not in manifest['manual']:
+                manifest['manual'].append(meme_template_id)
+                self._save_manifest(manifest)
+
+
+_vector_db = None
+_vector_db_lock = threading.Lock()
+
+
+def get_vector_db() -> VectorDB:
+    """Returns the process-wide VectorDB, opened (and synced) once and shared by every selection module."""
+    global _vector_db
+    with _vector_db_lock:
+        if _vector_db is None:
+            _vector_db = VectorDB()
+        return _vector_db
 
 
 if __name__ == '__main__':
@@ -1 +1 @@
-__all__ = ['helpers', 'img_flip_api', 'input_parser', 'validators', 'x_api']
+__all__ = ['helpers', 'img_flip_api', 'input_parser', 'validators', 'x_api', 'image_store', 'http_transport']
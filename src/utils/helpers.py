@@ -3,13 +3,16 @@ import subprocess
 import httpx
 import requests
 import yaml
+from functools import lru_cache
 from data.schemas import Meme
 from typing import List
 from pathlib import Path
 from datetime import datetime
 
 
+@lru_cache(maxsize=None)
 def get_git_root() -> Path:
+    # Cached because it is resolved through a git subprocess and called on every config load.
     try:
         git_root = subprocess.check_output(['git', 'rev-parse', '--show-toplevel'],
                                            stderr=subprocess.STDOUT).decode().strip()
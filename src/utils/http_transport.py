@@ -0,0 +1,165 @@
+import asyncio
+import logging
+import threading
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from utils.helpers import load_config
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+# A 429 or 503 with Retry-After means the server turned the request away without processing it, so even a POST
+# (an ImgFlip caption, a billed OpenRouter completion) can be sent again without creating or paying for it twice.
+_RETRY_AFTER_STATUSES = frozenset({429, 503})
+
+
+def _http_config():
+    return load_config('runtime.yaml').get('http', {})
+
+
+def _is_idempotent(method) -> bool:
+    return method.upper() in Retry.DEFAULT_ALLOWED_METHODS
+
+
+class _Retry(Retry):
+    """Retries idempotent requests on connection, read and status errors; any other request only on connection
+    errors (urllib3 refuses to retry read errors for methods outside allowed_methods) and on 429/503 responses
+    that carry Retry-After."""
+
+    def is_retry(self, method, status_code, has_retry_after=False):
+        if not self._is_method_retryable(method):
+            return bool(self.total and has_retry_after and status_code in _RETRY_AFTER_STATUSES)
+        return super().is_retry(method, status_code, has_retry_after)
+
+
+class HttpTransport:
+    """Pooled keep-alive HTTP session with default timeouts and retries with exponential backoff.
+
+    Only idempotent requests are retried after a read timeout or a retry status; a POST is retried when it never
+    reached the server or was turned away with Retry-After, see _Retry.
+    """
+
+    def __init__(self, connect_timeout=10, read_timeout=120, max_retries=3, backoff_factor=0.5, pool_maxsize=16,
+                 retry_statuses=(429, 500, 502, 503, 504)):
+        self.timeout = (connect_timeout, read_timeout)
+        retry = _Retry(total=max_retries,
+                       backoff_factor=backoff_factor,
+                       status_forcelist=retry_statuses,
+                       raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=pool_maxsize, pool_maxsize=pool_maxsize, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    @classmethod
+    def from_config(cls):
+        config = _http_config()
+        return cls(connect_timeout=config.get('connect_timeout', 10),
+                   read_timeout=config.get('read_timeout', 120),
+                   max_retries=config.get('max_retries', 3),
+                   backoff_factor=config.get('backoff_factor', 0.5),
+                   pool_maxsize=config.get('pool_maxsize', 16),
+                   retry_statuses=tuple(config.get('retry_statuses', (429, 500, 502, 503, 504))))
+
+    def request(self, method, url, **kwargs) -> requests.Response:
+        kwargs.setdefault('timeout', self.timeout)
+        return self.session.request(method, url, **kwargs)
+
+    def get(self, url, **kwargs) -> requests.Response:
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs) -> requests.Response:
+        return self.request('POST', url, **kwargs)
+
+
+class AsyncHttpTransport:
+    """Asyncio counterpart of HttpTransport built on a pooled httpx.AsyncClient.
+
+    An httpx.AsyncClient is bound to the event loop it is used on, so create one per loop:
+
+        async with AsyncHttpTransport.from_config() as transport:
+            response = await transport.post(url, data=data)
+    """
+
+    def __init__(self, connect_timeout=10, read_timeout=120, max_retries=3, backoff_factor=0.5, pool_maxsize=16,
+                 retry_statuses=(429, 500, 502, 503, 504)):
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.retry_statuses = set(retry_statuses)
+        self.client = httpx.AsyncClient(
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+            limits=httpx.Limits(max_connections=pool_maxsize, max_keepalive_connections=pool_maxsize))
+
+    @classmethod
+    def from_config(cls):
+        config = _http_config()
+        return cls(connect_timeout=config.get('connect_timeout', 10),
+                   read_timeout=config.get('read_timeout', 120),
+                   max_retries=config.get('max_retries', 3),
+                   backoff_factor=config.get('backoff_factor', 0.5),
+                   pool_maxsize=config.get('pool_maxsize', 16),
+                   retry_statuses=tuple(config.get('retry_statuses', (429, 500, 502, 503, 504))))
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    async def close(self):
+        await self.client.aclose()
+
+    @staticmethod
+    def _retry_after(response: httpx.Response):
+        try:
+            return float(response.headers['Retry-After'])
+        except (KeyError, ValueError):
+            return None
+
+    async def request(self, method, url, **kwargs) -> httpx.Response:
+        # Same rules as _Retry: a non-idempotent request is only sent again when it never reached the server or
+        # was turned away with Retry-After, never after a read timeout or a plain 5xx.
+        idempotent = _is_idempotent(method)
+        retry_errors = httpx.TransportError if idempotent else (httpx.ConnectError, httpx.ConnectTimeout)
+        attempt = 0
+        while True:
+            delay = self.backoff_factor * (2 ** attempt)
+            try:
+                response = await self.client.request(method, url, **kwargs)
+                retry_after = self._retry_after(response)
+                if idempotent:
+                    retry = response.status_code in self.retry_statuses
+                else:
+                    retry = response.status_code in _RETRY_AFTER_STATUSES and 'Retry-After' in response.headers
+                if not retry or attempt >= self.max_retries:
+                    return response
+                if retry_after is not None:
+                    delay = max(delay, retry_after)
+            except retry_errors as e:
+                if attempt >= self.max_retries:
+                    raise
+                logger.warning(f"Retrying {method} {url} after transport error: {e}")
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def get(self, url, **kwargs) -> httpx.Response:
+        return await self.request('GET', url, **kwargs)
+
+    async def post(self, url, **kwargs) -> httpx.Response:
+        return await self.request('POST', url, **kwargs)
+
+
+_http_transport = None
+_http_transport_lock = threading.Lock()
+
+
+def get_http_transport() -> HttpTransport:
+    """Returns the process-wide pooled transport, created from config/runtime.yaml on first use."""
+    global _http_transport
+    with _http_transport_lock:
+        if _http_transport is None:
+            _http_transport = HttpTransport.from_config()
+        return _http_transport
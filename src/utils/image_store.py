@@ -0,0 +1,211 @@
+import base64
+import hashlib
+import logging
+import mimetypes
+import os
+import tempfile
+import threading
+import requests
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Optional
+from utils.helpers import get_git_root, load_config
+from utils.http_transport import get_http_transport
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+_MAGIC_NUMBERS = [
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif'),
+]
+
+
+def detect_mime_type(data: bytes, url: str = '') -> str:
+    for magic, mime_type in _MAGIC_NUMBERS:
+        if data.startswith(magic):
+            return mime_type
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return 'image/webp'
+
+    mime_type = mimetypes.guess_type(url)[0]
+    if mime_type == 'image/jpg':
+        mime_type = 'image/jpeg'
+    return mime_type or 'image/jpeg'
+
+
+@dataclass
+class StoredImage:
+    url: str
+    data: bytes
+    mime_type: str
+    content_hash: str
+    _base64: Optional[str] = field(default=None, repr=False)
+
+    def get_bytes(self) -> bytes:
+        return self.data
+
+    def get_mime_type(self) -> str:
+        return self.mime_type
+
+    def get_base64(self) -> str:
+        # Encoded once per image and then shared by every provider that needs it.
+        if self._base64 is None:
+            self._base64 = base64.b64encode(self.data).decode('utf-8')
+        return self._base64
+
+    def get_data_url(self) -> str:
+        return f"data:{self.mime_type};base64,{self.get_base64()}"
+
+
+class ImageStore:
+    """Process-wide image cache: an in-memory LRU over a content-addressed disk tier.
+
+    URLs map to the SHA-256 of the image bytes, and the bytes are stored once per content hash,
+    so the same template reached through different URLs is only kept once on disk.
+    """
+
+    def __init__(self, path: Optional[Path], max_memory_mb: float = 256, inline_urls: bool = False):
+        self.path = Path(path) if path else None
+        self.max_memory_bytes = int(max_memory_mb * 1024 * 1024)
+        self.inline_urls = inline_urls
+        self.memory = OrderedDict()
+        self.memory_size = 0
+        self.lock = threading.Lock()
+        # Striped: urls share a fixed pool of locks, so a long run does not keep one lock per url ever fetched.
+        self.url_locks = [threading.Lock() for _ in range(64)]
+
+        if self.path:
+            (self.path / 'blobs').mkdir(parents=True, exist_ok=True)
+            (self.path / 'urls').mkdir(parents=True, exist_ok=True)
+
+    @classmethod
+    def from_config(cls):
+        config = load_config('runtime.yaml').get('image_store', {})
+        path = config.get('path', 'data/cache/images')
+        return cls(path=get_git_root() / path if config.get('disk', True) else None,
+                   max_memory_mb=config.get('max_memory_mb', 256),
+                   inline_urls=config.get('inline_urls', False))
+
+    def get(self, url: str) -> Optional[StoredImage]:
+        """Returns the image at url from memory, disk or the network, or None if it cannot be fetched."""
+        image = self._get_from_memory(url)
+        if image:
+            return image
+
+        with self._url_lock(url):
+            # Another thread may have fetched the same url while this one was waiting.
+            image = self._get_from_memory(url)
+            if image:
+                return image
+
+            image = self._get_from_disk(url)
+            if not image:
+                image = self._fetch(url)
+                if not image:
+                    return None
+                self._put_on_disk(image)
+            self._put_in_memory(image)
+            return image
+
+    def get_bytes(self, url: str) -> Optional[bytes]:
+        image = self.get(url)
+        return image.get_bytes() if image else None
+
+    def get_base64(self, url: str) -> Optional[str]:
+        image = self.get(url)
+        return image.get_base64() if image else None
+
+    def get_mime_type(self, url: str) -> Optional[str]:
+        image = self.get(url)
+        return image.get_mime_type() if image else None
+
+    def to_model_url(self, url: str) -> str:
+        """Returns the url to send to URL-based providers: an inline data URL if configured, else the url itself."""
+        if not self.inline_urls:
+            return url
+        image = self.get(url)
+        return image.get_data_url() if image else url
+
+    def _url_lock(self, url: str) -> threading.Lock:
+        return self.url_locks[hash(url) % len(self.url_locks)]
+
+    def _get_from_memory(self, url: str) -> Optional[StoredImage]:
+        with self.lock:
+            image = self.memory.get(url)
+            if image:
+                self.memory.move_to_end(url)
+            return image
+
+    def _put_in_memory(self, image: StoredImage):
+        with self.lock:
+            if image.url in self.memory:
+                return
+            self.memory[image.url] = image
+            self.memory_size += len(image.data)
+            while self.memory_size > self.max_memory_bytes and len(self.memory) > 1:
+                _, evicted = self.memory.popitem(last=False)
+                self.memory_size -= len(evicted.data)
+
+    def _url_key(self, url: str) -> str:
+        return hashlib.sha256(url.encode('utf-8')).hexdigest()
+
+    def _get_from_disk(self, url: str) -> Optional[StoredImage]:
+        if not self.path:
+            return None
+        url_file = self.path / 'urls' / self._url_key(url)
+        if not url_file.exists():
+            return None
+
+        content_hash, mime_type = url_file.read_text().split('\n')[:2]
+        blob_file = self.path / 'blobs' / content_hash
+        if not blob_file.exists():
+            return None
+        return StoredImage(url=url, data=blob_file.read_bytes(), mime_type=mime_type, content_hash=content_hash)
+
+    def _put_on_disk(self, image: StoredImage):
+        if not self.path:
+            return
+        blob_file = self.path / 'blobs' / image.content_hash
+        if not blob_file.exists():
+            self._write_atomic(blob_file, image.data)
+        self._write_atomic(self.path / 'urls' / self._url_key(image.url),
+                           f"{image.content_hash}\n{image.mime_type}\n{image.url}".encode('utf-8'))
+
+    @staticmethod
+    def _write_atomic(path: Path, data: bytes):
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent)
+        with os.fdopen(fd, 'wb') as file:
+            file.write(data)
+        os.replace(tmp_path, path)
+
+    def _fetch(self, url: str) -> Optional[StoredImage]:
+        try:
+            headers = {"User-Agent": "Mozilla/5.0"}  # Prevent Google from blocking the request
+            response = get_http_transport().get(url, headers=headers)
+            response.raise_for_status()
+        except requests.exceptions.RequestException as e:
+            print(f"Error fetching image from URL: {url} - {e}")
+            return None
+
+        data = response.content
+        return StoredImage(url=url,
+                           data=data,
+                           mime_type=detect_mime_type(data, url),
+                           content_hash=hashlib.sha256(data).hexdigest())
+
+
+_image_store = None
+_image_store_lock = threading.Lock()
+
+
+def get_image_store() -> ImageStore:
+    """Returns the process-wide image store, created from config/runtime.yaml on first use."""
+    global _image_store
+    with _image_store_lock:
+        if _image_store is None:
+            _image_store = ImageStore.from_config()
+        return _image_store
@@ -1,6 +1,8 @@
+import httpx
 import requests
 import os
 from urllib.parse import urlencode
+from utils.http_transport import AsyncHttpTransport, get_http_transport
 from utils.validators import HttpResponse
 from data.schemas import MemeImage
 from typing import Optional, List
@@ -14,11 +16,12 @@ class ImgFlipAPI:
         load_dotenv()
         self.username = os.getenv('IMG_FLIP_API_USERNAME')
         self.password = os.getenv('IMG_FLIP_API_PASSWORD')
+        self.transport = get_http_transport()
 
     def get_top100_used_meme_images(self) -> HttpResponse:
         url = f"{self.BASE_URL}/get_memes"
         try:
-            response = requests.get(url)
+            response = self.transport.get(url)
             response.raise_for_status()
             data = response.json()
 
@@ -39,12 +42,7 @@ class ImgFlipAPI:
         except requests.RequestException as e:
             return HttpResponse.failure(message=f"Error fetching meme templates: {str(e)}")
 
-    def caption_meme_image(self,
-                           meme_image_id: int,
-                           captions: Optional[List[str]] = None,
-                           no_watermark: bool = True) -> HttpResponse:
-        url = f"{self.BASE_URL}/caption_image"
-
+    def _caption_meme_image_data(self, meme_image_id: int, captions: List[str], no_watermark: bool) -> str:
         data = {
             'template_id': meme_image_id,
             'username': self.username,
@@ -59,24 +57,32 @@ class ImgFlipAPI:
         if no_watermark:
             data['no_watermark'] = True
 
-        encoded_data = urlencode(data)
+        return urlencode(data)
 
-        try:
-            response = requests.post(url, data=encoded_data,
-                                     headers={'Content-Type': 'application/x-www-form-urlencoded'})
-            response.raise_for_status()
+    @staticmethod
+    def _parse_caption_meme_image_result(result) -> HttpResponse:
+        if result['success']:
+            return HttpResponse.success(
+                data={'url': result['data']['url']},
+                message="Meme created successfully"
+            )
+        else:
+            return HttpResponse.failure(
+                message=result.get('error_message')
+            )
 
-            result = response.json()
+    def caption_meme_image(self,
+                           meme_image_id: int,
+                           captions: Optional[List[str]] = None,
+                           no_watermark: bool = True) -> HttpResponse:
+        url = f"{self.BASE_URL}/caption_image"
+        encoded_data = self._caption_meme_image_data(meme_image_id, captions, no_watermark)
 
-            if result['success']:
-                return HttpResponse.success(
-                    data={'url': result['data']['url']},
-                    message="Meme created successfully"
-                )
-            else:
-                return HttpResponse.failure(
-                    message=result.get('error_message')
-                )
+        try:
+            response = self.transport.post(url, data=encoded_data,
+                                           headers={'Content-Type': 'application/x-www-form-urlencoded'})
+            response.raise_for_status()
+            return self._parse_caption_meme_image_result(response.json())
 
         except requests.RequestException as e:
             return HttpResponse.failure(
@@ -84,42 +90,65 @@ class ImgFlipAPI:
                 status_code=500
             )
 
-    def get_meme_image(self,
-                       meme_image_id: int) -> HttpResponse:
+    async def caption_meme_image_async(self,
+                                       transport: AsyncHttpTransport,
+                                       meme_image_id: int,
+                                       captions: Optional[List[str]] = None,
+                                       no_watermark: bool = True) -> HttpResponse:
+        url = f"{self.BASE_URL}/caption_image"
+        encoded_data = self._caption_meme_image_data(meme_image_id, captions, no_watermark)
 
-        url = f"{self.BASE_URL}/get_meme"
+        try:
+            response = await transport.post(url, content=encoded_data,
+                                            headers={'Content-Type': 'application/x-www-form-urlencoded'})
+            response.raise_for_status()
+            return self._parse_caption_meme_image_result(response.json())
 
+        except httpx.HTTPError as e:
+            return HttpResponse.failure(
+                message=f"An exception occured while the creating meme: {str(e)}",
+                status_code=500
+            )
+
+    def _get_meme_image_data(self, meme_image_id: int) -> str:
         data = {
             'template_id': meme_image_id,
             'username': self.username,
             'password': self.password,
         }
 
-        encoded_data = urlencode(data)
+        return urlencode(data)
+
+    @staticmethod
+    def _parse_get_meme_image_result(result) -> HttpResponse:
+        if result['success']:
+            meme_image = MemeImage(id=result['data']['meme']['id'],
+                                   name=result['data']['meme']['name'],
+                                   url=result['data']['meme']['url'],
+                                   width=result['data']['meme']['width'],
+                                   height=result['data']['meme']['height'],
+                                   box_count=result['data']['meme']['box_count'],
+                                   times_used=result['data']['meme']['captions'])  # all time
+            return HttpResponse.success(
+                data=meme_image,
+                message="Meme created successfully"
+            )
+        else:
+            return HttpResponse.failure(
+                message=result.get('error_message')
+            )
+
+    def get_meme_image(self,
+                       meme_image_id: int) -> HttpResponse:
+
+        url = f"{self.BASE_URL}/get_meme"
+        encoded_data = self._get_meme_image_data(meme_image_id)
 
         try:
-            response = requests.post(url, data=encoded_data,
-                                     headers={'Content-Type': 'application/x-www-form-urlencoded'})
+            response = self.transport.post(url, data=encoded_data,
+                                           headers={'Content-Type': 'application/x-www-form-urlencoded'})
             response.raise_for_status()
-
-            result = response.json()
-
-            if result['success']:
-                meme_image = MemeImage(id=result['data']['meme']['id'],
-                                       name=result['data']['meme']['name'],
-                                       url=result['data']['meme']['url'],
-                                       width=result['data']['meme']['width'],
-                                       height=result['data']['meme']['height'],
-                                       box_count=result['data']['meme']['box_count'],
-                                       times_used=result['data']['meme']['captions'])  # all time
-                return HttpResponse.success(
-                    data=meme_image,
-                    message="Meme created successfully"
-                )
-            else:
-                return HttpResponse.failure(
-                    message=result.get('error_message')
-                )
+            return self._parse_get_meme_image_result(response.json())
 
         except requests.RequestException as e:
             return HttpResponse.failure(
@@ -127,7 +156,6 @@ class ImgFlipAPI:
                 status_code=500
             )
 
-
 if __name__ == '__main__':
     api = ImgFlipAPI()
     response = api.get_meme_image(216951317)
@@ -11,7 +11,8 @@ class BaselineVariant(MemeFact):
     def _run_impl(self, input_module: InputModule, **kwargs):
         generation_module = BaselineGenerationModule(ablation_input=input_module.get_ablation_input(),
                                                      params=kwargs['model_params'],
-                                                     parse=kwargs['parse'])
+                                                     parse=kwargs['parse'],
+                                                     max_workers=kwargs['max_workers'])
         return self._run_moderation_pipeline(generation_module=generation_module,
                                              enable_moderation=kwargs['moderate'],
                                              num_memes=self.config[self.class_name]['num_memes']
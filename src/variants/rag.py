@@ -1,17 +1,19 @@
 from meme_fact import MemeFact
 from modules.module1_input import InputModule
 from modules.module2_selection import SelectionModule
+from rag.vector_db import get_vector_db
 from modules.module3_generation import RAGGenerationModule
 
 
 class RagVariant(MemeFact):
 
     def _run_impl(self, input_module: InputModule, **kwargs):
-        selection_module = SelectionModule(input_module=input_module)
+        selection_module = SelectionModule(input_module=input_module, vector_db=get_vector_db())
         generation_module = RAGGenerationModule(selection_module=selection_module,
                                                 ablation_input=input_module.get_ablation_input(),
                                                 params=kwargs['model_params'],
-                                                parse=kwargs['parse'])
+                                                parse=kwargs['parse'],
+                                                max_workers=kwargs['max_workers'])
 
         return self._run_moderation_pipeline(generation_module=generation_module,
                                              num_memes=self.config[self.class_name]['num_memes']